@@ -1,124 +1,39 @@
-import time
-import serial
-import struct
-
-def calculate_crc(data):
-    crc = 0xFFFF
-    for pos in data:
-        crc ^= pos
-        for _ in range(8):
-            if crc & 0x0001:
-                crc >>= 1
-                crc ^= 0xA001
-            else:
-                crc >>= 1
-    return crc
-
-def open_serial_port(port, baudrate):
-    return serial.Serial(
-        port=port,
-        baudrate=baudrate,
-        bytesize=serial.EIGHTBITS,
-        parity=serial.PARITY_EVEN,
-        stopbits=serial.STOPBITS_ONE,
-        timeout=0,
-        rtscts=False,
-        dsrdtr=False
-    )
-
-def send_request(ser, request, response_length):
-    crc = calculate_crc(request)
-    request += struct.pack('<H', crc)
-    ser.write(request)
-    time.sleep(0.1)
-    response = ser.read(response_length)
-    if len(response) < response_length:
-        print(f"Error: Incomplete response (expected {response_length} bytes, got {len(response)} bytes)")
-        return None
-    if calculate_crc(response[:-2]) != struct.unpack('<H', response[-2:])[0]:
-        print("Error: CRC check failed")
-        return None
-    return response
+from modbus_rtu import close_all_sessions, get_session
+from motion_monitor import MotionMonitor
 
 def write_multiple_registers(port, baudrate, slave_address, register_address, values):
     try:
-        with open_serial_port(port, baudrate) as ser:
-            function_code = 0x10  # Function code for writing multiple registers
-            quantity_of_registers = len(values)
-            byte_count = 2 * quantity_of_registers
-            header = struct.pack('>BBHHB', slave_address, function_code, register_address, quantity_of_registers, byte_count)
-            data = b''.join(struct.pack('>H', value) for value in values)
-            request = header + data
-            print(f"Request (write multiple): {request.hex()}")
-            response = send_request(ser, request, 8)
-            if response is None:
-                return
-            print(f"Response (write multiple): {response.hex()}")
-            response_slave_address, response_function_code, response_register_address, response_quantity_of_registers = struct.unpack('>BBHH', response[:6])
-            if (response_slave_address == slave_address and response_function_code == function_code and
-                    response_register_address == register_address and response_quantity_of_registers == quantity_of_registers):
-                print(f"Successfully wrote values {values} to registers starting at {register_address} of slave {slave_address}")
-            else:
-                print("Error: Response does not match the request")
+        if get_session(port, baudrate).write_multiple_registers(slave_address, register_address, values):
+            print(f"Successfully wrote values {values} to registers starting at {register_address} of slave {slave_address}")
     except Exception as e:
         print(f"Exception: {e}")
 
 def write_single_register(port, baudrate, slave_address, register_address, value):
     try:
-        with open_serial_port(port, baudrate) as ser:
-            function_code = 0x06  # Function code for writing single register
-            request = struct.pack('>BBHH', slave_address, function_code, register_address, value)
-            print(f"Request (write single): {request.hex()}")
-            response = send_request(ser, request, 8)
-            if response is None:
-                return
-            print(f"Response (write single): {response.hex()}")
-            response_slave_address, response_function_code, response_register_address, response_value = struct.unpack('>BBHH', response[:6])
-            if (response_slave_address == slave_address and response_function_code == function_code and
-                    response_register_address == register_address and response_value == value):
-                print(f"Successfully wrote value {value} to register {register_address} of slave {slave_address}")
-            else:
-                print("Error: Response does not match the request")
+        if get_session(port, baudrate).write_single_register(slave_address, register_address, value):
+            print(f"Successfully wrote value {value} to register {register_address} of slave {slave_address}")
     except Exception as e:
         print(f"Exception: {e}")
 
 def read_register(port, baudrate, slave_address, register_address):
     try:
-        with open_serial_port(port, baudrate) as ser:
-            function_code = 0x03  # Function code for reading holding registers
-            request = struct.pack('>BBHH', slave_address, function_code, register_address, 1)
-            print(f"Request (read): {request.hex()}")
-            response = send_request(ser, request, 7)
-            if response is None:
-                return
-            print(f"Response (read): {response.hex()}")
-            if response[1] & 0x80:
-                print(f"Modbus exception response: {response[2]}")
-                return
-            register_value = struct.unpack('>H', response[3:5])[0]
-            print(f"Successfully read value {register_value} from register {register_address} of slave {slave_address}")
-            return register_value
+        register_value = get_session(port, baudrate).read_register(slave_address, register_address)
+        if register_value is None:
+            return
+        print(f"Successfully read value {register_value} from register {register_address} of slave {slave_address}")
+        return register_value
     except Exception as e:
         print(f"Exception: {e}")
 
 def read_multiple_registers(port, baudrate, slave_address, register_address, count):
     try:
-        with open_serial_port(port, baudrate) as ser:
-            function_code = 0x03  # Function code for reading holding registers
-            request = struct.pack('>BBHH', slave_address, function_code, register_address, count)
-            print(f"Request (read multiple): {request.hex()}")
-            response = send_request(ser, request, 5 + 2 * count)  # 5 bytes header + 2 bytes per register
-            if response is None:
-                return
-            print(f"Response (read multiple): {response.hex()}")
-            if response[1] & 0x80:
-                print(f"Modbus exception response: {response[2]}")
-                return
-            values = struct.unpack('>' + 'H' * count, response[3:3 + 2 * count])
-            combined_value = (values[1] << 16) | values[0]
-            print(f"Successfully read values {values} from registers starting at {register_address} of slave {slave_address}")
-            print(f"Combined value: {combined_value}")
-            return combined_value
+        values = get_session(port, baudrate).read_multiple_registers(slave_address, register_address, count)
+        if values is None:
+            return
+        combined_value = (values[1] << 16) | values[0]
+        print(f"Successfully read values {values} from registers starting at {register_address} of slave {slave_address}")
+        print(f"Combined value: {combined_value}")
+        return combined_value
     except Exception as e:
         print(f"Exception: {e}")
 
@@ -181,8 +96,10 @@ def main():
     # Single register write - TRIGGER SERVO ON
     write_single_register(port, baudrate, slave_address, int('0x050e', 16), 1)
 
-    # Read multiple registers and combine into single value
-    time.sleep(6)
+    # Wait for the move to finish, then read the settled 32-bit feedback
+    result = MotionMonitor(get_session(port, baudrate), slave_address).wait(
+        None if combined_value_start is None else combined_value_start + pulses, combined_value_start)
+    print(f"Motion {result.reason} after {result.elapsed:.3f} s")
     combined_value_end = read_multiple_registers(port, baudrate, slave_address, int('0x0012', 16), 2)
 
     print(f"Combined value start from registers 0x12 and 0x13: {combined_value_start}")
@@ -192,6 +109,8 @@ def main():
     AngleRotated = (Diff/ 8333.33333333333333333333)    #30,00,000 pulses / 360 degrees = 8333.33333333333333333333
     print(f"The Current position is: {AngleRotated}")
 
+    close_all_sessions()
+
 
 
 if __name__ == "__main__":
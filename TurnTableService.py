@@ -1,35 +1,108 @@
-import RPi.GPIO as GPIO
 import time
 import datetime
 import logging  
 import json
+import math
+import signal
+import threading
 from threading import Thread
 import subprocess
 import zmq
 
+from hal import GPIO
+import devices
+import scan_plan
+import metrics
+from status_publisher import StatusPublisher
+
 # Topics 
 # =================
+# Commands carry "device": <id> to pick a table (see devices); without it they go to the
+# first table. Every status of a table carries its "device".
+# Commands :
+#          {"action": "turn", "angle": <deg>}   queued, acked with "queued" + job id
+#          {"action": "move_to", "angle": <deg>}   queued like a turn; shortest move to
+#                                               that angle from home
+#          {"action": "cancel", "job": <id>}    drop a queued turn (all if no job)
+#          {"action": "stop"}                   drop queued turns and abort the move
+#          {"action": "scan", "angles": [<deg>, ...] | "stops": <n>, "step": <deg>,
+#           "dwell": <s>, "capture": true}      multi-stop plan run as one job, see scan_plan
+#          {"action": "spin_start", "rpm": <table rpm>}   continuous rotation (sign: direction),
+#                                               queued like a turn, runs until spin_stop
+#          {"action": "spin_speed", "rpm": <table rpm>}   change the speed of the running spin
+#          {"action": "spin_stop"}              ramp the running spin down to a stop
+#          {"action": "angle_at", "timestamps": [<epoch s>, ...]}   table angles at those
+#                                               times from the encoder samples (servo tables)
+# Commands also arrive on the ROUTER socket (ROUTER_PORT) from DEALER clients, with an "id"
+# of the client's choosing. The sender gets
+#          {"reply": "ack", "id": <id>, "status": <queued|error|...>, "received": <epoch s>, ...}
+#                                               at once (status "ok" for cancel/stop/spin_stop),
+#          {"reply": "result", "id": <id>, "status": <completed|cancelled|error>, "job",
+#           "started": <epoch s>, "ended": <epoch s>, "position", ...}   when its job ends.
+# Everything still goes out on the status stream for observers.
 # Status :
+#          ready         the service accepts commands: startup (s since start), devices
 #          connected
 #          not_connected  
 #          idle  
+#          queued
 #          started
 #          processing
-#          completed
+#          completed     job, angle, position (deg; the drive's feedback on a servo), steps
+#          cancelled
 #          error
+#          at_angle      one per scan stop: job, seq, angle, target, capture, stops
+#          spin_speed    a spin_speed command was applied: job, rpm
+#          angle_at      reply to angle_at: timestamps, angles (null outside the sampled window)
+# Stats :
+#          [b"stats", json]  stage latencies (p50/p99/max, us) and counters, see metrics
 
 # Data : 
-#       json dump string
+#       [b"status.<status>", json dump string]  (multipart; see status_publisher)
 
 logging.basicConfig(level=logging.DEBUG)
 
-pub_context = zmq.Context()
-sub_context = zmq.Context()
+# Start of the process as far as startup time is concerned
+STARTED = time.monotonic()
+
+# One zmq context for all sockets, created in main()
+context = None
 publisher = None
 subscriber = None 
-flagProcessing=0 
- 
-GPIO.cleanup() 
+status_publisher = None
+# Command endpoint with replies: clients connect a DEALER socket to ROUTER_PORT
+router = None
+ROUTER_PORT = 9964
+# Job results travel from the table workers to the listener thread (which owns the router) over
+# an inproc pipe; pending_results maps (device id, job id) to the client waiting for the result.
+results_in = None
+results_out = None
+results_lock = threading.Lock()
+pending_results = {}
+listener_thread = None
+# Id of the table when there is no devices config
+DEFAULT_DEVICE = "turntable"
+
+# Turn commands waiting behind the running move; more are rejected with "queue full"
+MAX_QUEUED_JOBS = 16
+# Merge consecutive queued relative turns into a single move
+COALESCE_TURNS = False
+
+# Status publishing: "json", "binary" (struct) or "msgpack" payloads; topic frames
+# "status.<state>" unless STATUS_TOPICS is False (single-frame json, the old format)
+STATUS_ENCODING = "json"
+STATUS_TOPICS = True
+STATUS_HEARTBEAT = 5.0
+# Stage latency histograms and error counters go out on topic "stats" every STATS_INTERVAL
+# seconds while metrics are enabled (TURNTABLE_STATS=1)
+STATS_INTERVAL = 10.0
+stats_reporter = None
+# "ready" goes out when the first status subscriber joins, or after READY_TIMEOUT seconds
+# without one; the listener takes commands from the start either way
+READY_TIMEOUT = 2.0
+# Seconds between reads of the subscriptions queued on the status socket once ready
+SUBSCRIPTION_DRAIN = 1.0
+publisher_lock = threading.Lock()
 
 # Define the GPIO pins for Pulse (PUL) and Direction (DIR)
 PUL_PIN = 18  # Replace with the actual GPIO pin numbers you're using
@@ -41,189 +114,351 @@ Motor_ena_pin = 23
 # Define the GPIO pin to which the Hall Effect sensor is connected
 hall_effect_pin = 6  # Replace with the actual GPIO pin number
 
-# Set up GPIO
-GPIO.setmode(GPIO.BCM)
-GPIO.setup(PUL_PIN, GPIO.OUT)
-GPIO.setup(DIR_PIN, GPIO.OUT)
-# Set the buzzer pin as an output
-GPIO.setup(Motor_ena_pin, GPIO.OUT)
-GPIO.output(Motor_ena_pin, GPIO.LOW)
+# Optional camera trigger pulsed at every scan stop with capture set (BCM pin, or None)
+CAPTURE_PIN = None
+CAPTURE_PULSE = 0.001
+
+# Motion profile for rotate(), in steps/s and steps/s^2. START_SPEED is the old constant
+# delay of 0.00035 s per half step (prev 0.00048), which the motor starts at without stalling.
+START_SPEED = 1 / (2 * 0.00035)
+MAX_SPEED = 4800
+ACCELERATION = 16000
+MOTION_PROFILE = 'trapezoid'  # or 's_curve'
+STEPS_PER_REVOLUTION = 12800
+
+
+def load_devices():
+    # Tables from devices.DEVICES_FILE, else the single stepper table on the pins above
+    entries = devices.load_config()
+    if entries is None:
+        entries = [{"id": DEFAULT_DEVICE, "type": "stepper", "pul_pin": PUL_PIN, "dir_pin": DIR_PIN,
+                    "hall_pin": hall_effect_pin, "enable_pin": Motor_ena_pin, "capture_pin": CAPTURE_PIN,
+                    "capture_pulse": CAPTURE_PULSE, "steps_per_revolution": STEPS_PER_REVOLUTION,
+                    "start_speed": START_SPEED, "max_speed": MAX_SPEED, "acceleration": ACCELERATION, "profile": MOTION_PROFILE}]
+    return devices.create_devices(entries, GPIO)
+
+
+# Device registry and its default table, created by init_hardware()
+registry = None
+table = None
+# The default table's SimulatedStepper off the Pi (see drivers.StepperDriver)
+simulated_table = None
+
+
+def init_hardware():
+    # Pin setup and the tables, on first use instead of at import
+    global registry,table,simulated_table
+    if registry is None:
+        # Each stepper table sets up its own pins (see devices)
+        GPIO.setmode(GPIO.BCM)
+        registry = load_devices()
+        table = registry.default
+        simulated_table = getattr(table.driver, 'simulated', None)
+    return registry
 
-# angle init
-current_angle = 0
 
 def get_angle(angle_input):
-  global current_angle
-  current_angle = (current_angle + angle_input) % 360
-  return (current_angle + 360) % 360  # Ensure positive value
+  # Angle a turn by angle_input would reach; the position itself is kept by the table's driver
+  init_hardware()
+  return (table.current_angle + angle_input) % 360
 
 
-def control_stepper(delay, steps, clockwise=True):
-        # Set the direction (clockwise or counterclockwise)
-        if clockwise:
-            GPIO.output(DIR_PIN, GPIO.LOW)
-        else:
-            GPIO.output(DIR_PIN, GPIO.HIGH)
-        # Generate step pulses
-        for _ in range(steps):
-            GPIO.output(PUL_PIN, GPIO.LOW)
-            time.sleep(delay)
-            GPIO.output(PUL_PIN, GPIO.HIGH)
-            time.sleep(delay)
+def get_step_backend():
+    init_hardware()
+    return table.driver.backend
 
 
 def home():
-    # Function to control the stepper motor
-    def control_stepper(delay, steps, clockwise=True):
-        # Set the direction (clockwise or counterclockwise)
-        if clockwise:
-            GPIO.output(DIR_PIN, GPIO.LOW)
-        else:
-            GPIO.output(DIR_PIN, GPIO.HIGH)
-        # Generate step pulses
-        for _ in range(steps):
-            GPIO.output(PUL_PIN, GPIO.LOW)
-            time.sleep(delay)
-            GPIO.output(PUL_PIN, GPIO.HIGH)
-            time.sleep(delay)
-
-
-    #Initial Push away from the current position: Just a random 90 degree forward move
-    control_stepper(.0005, 90, clockwise=False)
-    for i in range(1,5):
-        # Read the state of the Hall Effect sensor (HIGH or LOW)
-        control_stepper(.0005, 12800, clockwise=False)
-        sensor_state = GPIO.input(hall_effect_pin)
-
-        if sensor_state == GPIO.HIGH:
-            print("Magnetic field detected!")
-            break
-    # Correction of 15 degree forward to compensate for the long magnet premature detection
-    control_stepper(.0005, 15, clockwise=False)
+    init_hardware()
+    return table.home()
 
-def rotate(Angle):
-# Angle = 36000
-    Steps_per_Revolution = 12800 #previous = 400
-    # delay = 0.0005  # Delay between steps (adjust for your motor and application)
-
-    Degree_per_Step = 360/Steps_per_Revolution
-
-    print("Angle = {}".format(Angle))
-    print("....................")
-    print()
-    print("Degree per Step = {} ".format(Degree_per_Step))
-
-    # Define motor parameters
-    steps = int(abs(Angle)*(Steps_per_Revolution/360)) # Number of steps per revolution for your motor
-    delay = 0.00035     # Delay between steps (adjust for your motor and application)                 prev deLay= 0.00048
-    print("Number of Steps = {}".format(steps))
-
-    # Function to move the motor a specified number of steps in a direction
-    def move_motor(direction, steps):
-        GPIO.output(DIR_PIN, direction)  # Set the direction (HIGH for forward, LOW for backward)
-        for _ in range(steps):
-            GPIO.output(PUL_PIN, GPIO.HIGH)
-            time.sleep(delay)
-            GPIO.output(PUL_PIN, GPIO.LOW)
-            time.sleep(delay)
-            
 
+def rotate(Angle):
+    # Turns the default table; returns the signed steps made
+    init_hardware()
+    return table.turn(Angle)
+
+
+def drain_subscriptions():
+    # The XPUB socket queues a message for every (un)subscription; read them so they do not pile
+    # up. Under the publishers' lock, since their heartbeat threads send on the same socket.
+    # True when a new subscriber came in.
+    subscribed = False
+    with publisher_lock:
+        while True:
+            try:
+                message = publisher.recv(zmq.NOBLOCK)
+            except zmq.Again:
+                return subscribed
+            subscribed = subscribed or message[:1] == b'\x01'
+
+
+def publish(status, **fields):
+    # Messages that belong to no table (bad json, unknown device) go out on the default publisher
+    fields.setdefault("timestamp", datetime.datetime.now().timestamp())
+    status_publisher.publish(status, state=status_publisher.state, **fields)
+
+
+def send_reply(client, reply, **fields):
+    # client: (envelope frames, correlation id) of a command that came in on the router socket.
+    # Only the listener thread touches the router; everyone else goes through the results pipe.
+    envelope, request_id = client
+    message = {"reply": reply, "id": request_id}
+    message.update(fields)
+    frames = list(envelope) + [json.dumps(message).encode()]
+    if threading.current_thread() is listener_thread:
+        router.send_multipart(frames)
+    else:
+        with results_lock:
+            results_out.send_multipart(frames)
+
+
+def submit_job(device, client, angle, **options):
+    # Remember who asked before the worker can finish the job
+    with results_lock:
+        job = device.scheduler.submit(angle, **options)
+        if job is not None and client is not None:
+            pending_results[(device.id, job.id)] = client
+    return job
+
+
+def send_result(device, event, job, message):
+    # Final result of a job to the router client that submitted it (and of any turns merged into it)
+    if event not in ("completed", "cancelled", "error"):
+        return
+    with results_lock:
+        clients = [pending_results.pop((device.id, each.id), None) for each in [job] + job.merged]
+    for client in clients:
+        if client is not None:
+            send_reply(client, "result", status=event, **message)
+
+
+def handle_command(strResponse, received, envelope=None):
+    # One command from the SUB socket, or from the router socket with the sender's envelope. Every command
+    # is acknowledged at once: on the status stream as before, and to a router client as an "ack"
+    # with its correlation id. Jobs then end with a "result" carrying their start and end times.
+    def respond(device, status, **fields):
+        fields.setdefault("timestamp", received)
+        if status != "ok":
+            if device is None:
+                publish(status, **fields)
+            else:
+                device.publish(status, **fields)
+        if envelope is not None:
+            send_reply((envelope, request_id), "ack", status=status, received=received, **fields)
+
+    request_id = None
+    stage = metrics.start()
     try:
-        # Example: Rotate the motor 200 steps clockwise
-        if Angle>0:
-            move_motor(GPIO.LOW, steps)
+        jsonMessage = json.loads(strResponse)
+        if not isinstance(jsonMessage, dict):
+            raise ValueError("not an object")
+    except ValueError:
+        respond(None, "error", reason="invalid json")
+        metrics.count('command.invalid')
+        return
+    metrics.observe('command.parse', stage)
+    print("Received Message ",jsonMessage)
+    request_id = jsonMessage.get("id")
+    client = None if envelope is None else (envelope, request_id)
+
+    action=jsonMessage.get("action")
+    angle=jsonMessage.get("angle")
+
+    # Moves run on each table's executor thread
+    device_id = jsonMessage.get("device")
+    if device_id is not None and not isinstance(device_id, str):
+        respond(None, "error", reason="device must be a string")
+        return
+    device = registry.get(device_id)
+    if device is None:
+        respond(None, "error", device=device_id, reason="unknown device")
+        return
+    scheduler = device.scheduler
+    if(action in ("turn", "move_to")):
+        if isinstance(angle, bool) or not isinstance(angle, (int, float)):
+            respond(device, "error", reason="angle must be a number")
+            return
+        job = submit_job(device, client, angle, action=action)
+        if job is None:
+            respond(device, "error", angle=angle, reason="queue full")
+        else:
+            respond(device, "queued", job=job.id, angle=angle, pending=scheduler.pending())
+    elif(action=="scan"):
+        try:
+            plan = scan_plan.parse_plan(jsonMessage, device.current_angle)
+        except ValueError as e:
+            respond(device, "error", reason=str(e))
+            return
+        job = submit_job(device, client, None, action="scan", plan=plan)
+        if job is None:
+            respond(device, "error", reason="queue full")
+        else:
+            respond(device, "queued", job=job.id, stops=len(plan), pending=scheduler.pending())
+    elif(action in ("spin_start", "spin_speed", "spin_stop") and not device.driver.can_spin):
+        respond(device, "error", reason="spins need velocity_mode in the device config")
+    elif(action in ("spin_start", "spin_speed")):
+        rpm = jsonMessage.get("rpm")
+        if isinstance(rpm, bool) or not isinstance(rpm, (int, float)):
+            respond(device, "error", reason="rpm must be a number")
+        elif action == "spin_speed":
+            # The spin may end at any time on the worker: read the job once
+            job = device.spinning
+            if job is not None and device.set_spin_speed(rpm):
+                respond(device, "spin_speed", job=job.id, rpm=rpm)
+            else:
+                respond(device, "error", reason="not spinning")
+        else:
+            job = submit_job(device, client, None, action="spin", speed=rpm)
+            if job is None:
+                respond(device, "error", reason="queue full")
+            else:
+                respond(device, "queued", job=job.id, rpm=rpm, pending=scheduler.pending())
+    elif(action=="spin_stop"):
+        if device.stop_spin():
+            respond(device, "ok")
+        else:
+            respond(device, "error", reason="not spinning")
+    elif(action=="angle_at"):
+        timestamps = jsonMessage.get("timestamps")
+        if not isinstance(timestamps, list) or not all(
+                isinstance(t, (int, float)) and not isinstance(t, bool) for t in timestamps):
+            respond(device, "error", reason="timestamps must be a list of numbers")
+            return
+        # Status timestamps are wall clock, samples are monotonic
+        offset = time.time() - time.monotonic()
+        angles = device.angle_at([t - offset for t in timestamps])
+        if angles is None:
+            respond(device, "error", reason="no encoder sampling")
         else:
-            move_motor(GPIO.HIGH, steps)
-        
+            respond(device, "angle_at", timestamps=timestamps,
+                    angles=[None if math.isnan(a) else a for a in angles.tolist()])
+    elif(action=="cancel"):
+        # Drops queued turns (one by "job" id, or all); the running move continues
+        cancelled = scheduler.cancel(jsonMessage.get("job"))
+        respond(device, "ok", cancelled=[job.id for job in cancelled])
+    elif(action=="stop" and scheduler.current is not None and not device.driver.can_interrupt):
+        # Nothing would stop the running move; "cancel" still drops the queued ones
+        respond(device, "error", reason="stopping a move needs velocity_mode in the device config")
+    elif(action=="stop"):
+        cancelled, current = scheduler.stop()
+        respond(device, "ok", cancelled=[job.id for job in cancelled],
+                stopped=None if current is None else current.id)
+    else:
+        respond(device, "error", reason="unknown action %s" % action)
 
-    except KeyboardInterrupt:
-        pass  # Handle keyboard interrupt
-# 
-    finally:
-        #GPIO.cleanup()  # Clean up GPIO pins on program exit
-        print("Rotation done with angle {}".format(Angle))
 
-  
 def listening_events(): 
-    global publisher,subscriber,flagProcessing
-     
+    global publisher,subscriber
+
+    poller = zmq.Poller()
+    poller.register(subscriber, zmq.POLLIN)
+    poller.register(router, zmq.POLLIN)
+    poller.register(results_in, zmq.POLLIN)
+    announced = False
+    ready_deadline = time.monotonic() + READY_TIMEOUT
+    next_drain = 0.0
     while True:
-        strResponse = subscriber.recv_string()
-        jsonMessage = json.loads(strResponse) 
-        print("Received Message ",jsonMessage)
-
-        action=jsonMessage["action"] 
-        angle=jsonMessage["angle"] 
-
-        current_timestamp =  datetime.datetime.now().timestamp()
-        if(flagProcessing==0):
-            if(action=="turn"):
-                    flagProcessing=1             
-                    jsonData = json.dumps({"status":"started", "timestamp" : current_timestamp}) 
-                    publisher.send_string(jsonData)
-
-                    rotate(angle)
-                    #print(get_angle(angle))
-    
-                    jsonData = json.dumps({"status":"completed", "timestamp" : current_timestamp, "angle": angle}) 
-                    publisher.send_string(jsonData)
-                    flagProcessing=0
-                
-                    
-        if(flagProcessing==1):
-                jsonData = json.dumps({"status":"processing", "timestamp" : current_timestamp}) 
-                publisher.send_string(jsonData)
-                
-
-def send_status():
-    global flagProcessing,publisher,subscriber
-
-    while True: 
-        current_timestamp =  datetime.datetime.now().timestamp()
-
-        if(flagProcessing==0):    
-            jsonData = json.dumps({"status":"idle", "timestamp" : current_timestamp}) 
-            publisher.send_string(jsonData)   
-            
-            time.sleep(1)
-
-        else:              
-            jsonData = json.dumps({"status":"processing", "timestamp" : current_timestamp}) 
-            publisher.send_string(jsonData)     
-            
-            time.sleep(1)
-
-def main():
-    global flagProcessing,publisher,subscriber
-
-    client_publisher_ip   = "192.168.1.210" # 
-    client_publisher_port = 9944  #  
-    turntable_publisher_port = 9954  # 
-
-    publisher = pub_context.socket(zmq.PUB)
+        # Stage timings start once a message is ready, not while the service waits for one
+        ready = dict(poller.poll(100 if not announced else SUBSCRIPTION_DRAIN * 1000))
+        now = time.monotonic()
+        if not announced or now >= next_drain:
+            next_drain = now + SUBSCRIPTION_DRAIN
+            subscribed = drain_subscriptions()
+            if not announced and (subscribed or now >= ready_deadline):
+                announced = True
+                publish("ready", startup=now - STARTED, devices=[device.id for device in registry])
+        if results_in in ready:
+            # Job results from the table workers, on their way to router clients
+            while True:
+                try:
+                    router.send_multipart(results_in.recv_multipart(zmq.NOBLOCK))
+                except zmq.Again:
+                    break
+        for socket in (subscriber, router):
+            if socket not in ready:
+                continue
+            received = metrics.start()
+            frames = socket.recv_multipart()
+            metrics.observe('zmq.recv', received)
+            # A router message is [identity, (empty delimiter,) payload]; replies go back with the same envelope
+            try:
+                handle_command(frames[-1], time.time(), frames[:-1] if socket is router else None)
+            except Exception as e:
+                # One bad command must not take the listener (and every later command) down with it
+                metrics.count('command.failed')
+                print("Error handling command {!r}: {}".format(frames[-1], e))
+            # Receive to acknowledgement sent
+            metrics.observe('command.ack', received)
+
+
+def main(client_publisher_ip="192.168.1.210", client_publisher_port=9944, turntable_publisher_port=9954,
+         router_port=ROUTER_PORT):
+    global context,publisher,subscriber,status_publisher,stats_reporter,router,results_in,results_out,listener_thread
+
+    init_hardware()
+    context = zmq.Context.instance()
+    # XPUB publishes like PUB to the clients' SUB sockets and also shows us their subscriptions
+    publisher = context.socket(zmq.XPUB)
     publisher.bind("tcp://*:%s" % turntable_publisher_port)
-    time.sleep(1)
     
-    subscriber = sub_context.socket(zmq.SUB)
-    subscriber.connect("tcp://%s:%s" % (client_publisher_ip,client_publisher_port))
+    # zmq keeps reconnecting in the background until the command publisher is up
+    subscriber = context.socket(zmq.SUB)
     subscriber.setsockopt_string(zmq.SUBSCRIBE, "")
-    time.sleep(1)
+    subscriber.connect("tcp://%s:%s" % (client_publisher_ip,client_publisher_port))
+    # Commands with an ack and a result for the sender; a DEALER queues its commands until
+    # connected, so none are lost to a late join the way early PUB/SUB commands are.
+    router = context.socket(zmq.ROUTER)
+    router.bind("tcp://*:%s" % router_port)
+    results_in = context.socket(zmq.PULL)
+    results_in.bind("inproc://turntable-results")
+    results_out = context.socket(zmq.PUSH)
+    results_out.connect("inproc://turntable-results")
     
-    thSendStatus = Thread(target=send_status)
-    thSendStatus.start()
-
-    thListener = Thread(target=listening_events)
+    # Status goes out on every transition, with a heartbeat in between. One publisher (and
+    # heartbeat) per table, all on the one PUB socket and its lock; the default table's
+    # publisher also carries messages that belong to no table. The listener announces
+    # "ready" once a status subscriber is there to see it.
+    publishers = []
+    for device in registry:
+        device_publisher = StatusPublisher(publisher, encoding=STATUS_ENCODING, heartbeat=STATUS_HEARTBEAT,
+                                           topics=STATUS_TOPICS, lock=publisher_lock)
+        device.start(device_publisher, max_queue=MAX_QUEUED_JOBS, coalesce=COALESCE_TURNS)
+        device.on_result = lambda event, job, message, device=device: send_result(device, event, job, message)
+        device.publish("idle")
+        device_publisher.start()
+        publishers.append(device_publisher)
+    status_publisher = table.publisher
+    if metrics.ENABLED:
+        stats_reporter = metrics.Reporter(status_publisher.publish_stats, STATS_INTERVAL)
+        stats_reporter.start()
+
+    # A daemon, so a SIGTERM in the main thread can end the process
+    thListener = listener_thread = Thread(target=listening_events, daemon=True)
     thListener.start()     
 
     thListener.join() 
-    thSendStatus.join() 
+    if stats_reporter is not None:
+        stats_reporter.close()
+    for device_publisher in publishers:
+        device_publisher.close()
     
 
 
-if __name__ == "__main__":
+def shutdown(signum, frame):
+    # systemd stops the service with SIGTERM: leave main() the way Ctrl-C does, so the finally
+    # below closes the tables and marks their journals clean
+    raise SystemExit(0)
+
 
-    # move to home position 
-    #home()
+if __name__ == "__main__":
 
-    main()
-    GPIO.cleanup() 
\ No newline at end of file
+    signal.signal(signal.SIGTERM, shutdown)
+    try:
+        # move every table to its home position, unless its journal says where it is
+        init_hardware().restore_positions()
+        main()
+    finally:
+        if registry is not None:
+            registry.close()
+        GPIO.cleanup() 
\ No newline at end of file
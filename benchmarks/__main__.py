@@ -0,0 +1,23 @@
+"""Run every benchmark with its default settings: python -m benchmarks"""
+import subprocess
+import sys
+
+BENCHMARKS = ('bench_crc', 'bench_modbus', 'bench_bus', 'bench_steps', 'bench_scheduler', 'bench_move',
+              'bench_homing', 'bench_scan', 'bench_journal', 'bench_service', 'bench_router',
+              'bench_load')
+
+
+def main():
+    failed = []
+    for name in BENCHMARKS:
+        print(f"== {name}", flush=True)
+        # Separate processes: bench_move, bench_service and bench_load all own the service module state.
+        if subprocess.call([sys.executable, '-m', 'benchmarks.' + name]) != 0:
+            failed.append(name)
+    if failed:
+        print("failed: " + ", ".join(failed))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
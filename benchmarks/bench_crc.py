@@ -0,0 +1,70 @@
+"""CRC16 and request-frame micro-benchmark.
+
+Compares the original bit-by-bit CRC and bytes-concatenating frame code
+(copied below as the baseline) against crc16.py.
+
+    python -m benchmarks.bench_crc [--number N]
+"""
+import argparse
+import struct
+import timeit
+
+from crc16 import FrameBuilder, calculate_crc, check_crc
+
+
+def legacy_calculate_crc(data):
+    crc = 0xFFFF
+    for pos in data:
+        crc ^= pos
+        for _ in range(8):
+            if crc & 0x0001:
+                crc >>= 1
+                crc ^= 0xA001
+            else:
+                crc >>= 1
+    return crc
+
+
+def legacy_write_multiple_frame(slave_address, register_address, values):
+    header = struct.pack('>BBHHB', slave_address, 0x10, register_address, len(values), 2 * len(values))
+    data = b''.join(struct.pack('>H', value) for value in values)
+    request = header + data
+    return request + struct.pack('<H', legacy_calculate_crc(request))
+
+
+def legacy_check(response):
+    return legacy_calculate_crc(response[:-2]) == struct.unpack('<H', response[-2:])[0]
+
+
+def _rate(stmt, number):
+    seconds = min(timeit.repeat(stmt, number=number, repeat=3))
+    return seconds / number * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--number', type=int, default=2000, help="iterations per measurement")
+    args = parser.parse_args()
+
+    builder = FrameBuilder()
+    print(f"{'registers':>9} {'bytes':>5} | {'crc old':>8} {'crc new':>8} | "
+          f"{'frame old':>9} {'frame new':>9} | {'check old':>9} {'check new':>9}  (us/op)")
+    for count in (1, 2, 4, 16, 64, 123):
+        values = [(i * 7919) & 0xFFFF for i in range(count)]
+        frame = legacy_write_multiple_frame(1, 0x0606, values)
+        assert bytes(builder.write_multiple_registers(1, 0x0606, values)) == frame
+        assert calculate_crc(frame[:-2]) == legacy_calculate_crc(frame[:-2])
+        view = memoryview(frame)
+
+        crc_old = _rate(lambda: legacy_calculate_crc(frame), args.number)
+        crc_new = _rate(lambda: calculate_crc(view), args.number)
+        build_old = _rate(lambda: legacy_write_multiple_frame(1, 0x0606, values), args.number)
+        build_new = _rate(lambda: builder.write_multiple_registers(1, 0x0606, values), args.number)
+        check_old = _rate(lambda: legacy_check(frame), args.number)
+        check_new = _rate(lambda: check_crc(view), args.number)
+        print(f"{count:>9} {len(frame):>5} | {crc_old:>8.2f} {crc_new:>8.2f} | "
+              f"{build_old:>9.2f} {build_new:>9.2f} | {check_old:>9.2f} {check_new:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""Two-phase homing with the cached home offset on simulated hardware.
+
+Homes a simulated stepper table from several starting points, on and off
+the magnet. The first homing measures the magnet and caches the offset,
+every later one must reuse it; all of them must end on the magnet's
+centre to within a step, and leave the pulse pin so the next move makes
+all its steps. Reports the time and steps of each homing.
+
+    python -m benchmarks.bench_homing
+"""
+import os
+import tempfile
+
+from drivers import StepperDriver
+from homing import Homing, load_offset
+from sim_devices import SimulatedGPIO
+
+STEPS_PER_REV = 12800
+MAGNET_STEP = STEPS_PER_REV // 2
+# Moves before each homing: none, a quarter turn on, none (still on the magnet), just past its edge
+MOVES = (0, 3200, 0, 40)
+
+
+def main():
+    gpio = SimulatedGPIO()
+    driver = StepperDriver(gpio, 18, 19, hall_pin=6, steps_per_revolution=STEPS_PER_REV)
+    table = driver.simulated
+    with tempfile.TemporaryDirectory() as directory:
+        offset_file = os.path.join(directory, 'home_offset.json')
+        offsets = set()
+        for index, steps in enumerate(MOVES):
+            position = table.position
+            driver.move_steps(steps)
+            if table.position - position != steps:
+                raise RuntimeError(f"move of {steps} steps after homing moved the table {table.position - position}")
+            start = table.position % STEPS_PER_REV
+            # The homing StepperDriver.home() runs, with the result it only reports
+            result = Homing(gpio, driver.backend, driver.pul_pin, driver.dir_pin, driver.hall_pin,
+                            STEPS_PER_REV, fast_speed=2 * driver.start_speed, start_speed=driver.start_speed,
+                            acceleration=driver.acceleration, offset_file=offset_file).home()
+            if not result.found:
+                raise RuntimeError(f"home not found from step {start}")
+            if result.measured != (index == 0):
+                raise RuntimeError(f"homing {index + 1} {'measured' if result.measured else 'reused'} the offset")
+            offsets.add(result.offset_steps)
+            error = (table.position - MAGNET_STEP + STEPS_PER_REV // 2) % STEPS_PER_REV - STEPS_PER_REV // 2
+            if abs(error) > 1:
+                raise RuntimeError(f"homing from step {start} ended {error} steps off the magnet centre")
+            print(f"from step {start:>5}: {'measured' if result.measured else 'cached  '} offset "
+                  f"{result.offset_steps}, {result.steps_moved:>5} steps in {result.elapsed * 1e3:6.0f} ms, "
+                  f"{error:+d} steps off centre")
+        if len(offsets) != 1 or load_offset(offset_file) not in offsets:
+            raise RuntimeError(f"home offset changed between homings: {sorted(offsets)}")
+    driver.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Position journal recovery and warm restart on simulated hardware.
+
+Tears the newest journal record the way a crash in the middle of a write
+would and fails unless the previous record is loaded. Then restarts a
+simulated stepper table after a clean and after an unclean shutdown: the
+first must resume from the journal without moving, the second must home.
+
+    python -m benchmarks.bench_journal
+"""
+import contextlib
+import io
+import os
+import tempfile
+import time
+
+from devices import Turntable
+from drivers import StepperDriver
+from motion_scheduler import MotionJob
+from position_journal import STATE_CLEAN, PositionJournal
+from sim_devices import SimulatedGPIO
+
+
+def _torn_write(path):
+    journal = PositionJournal(path)
+    previous = journal.write(10.0, 355, True)
+    newest = journal.write(20.0, 711, True)
+    journal.close(clean=False)
+    # The newest record went to slot sequence % 2; keep only its first bytes, as a torn write would
+    with open(path, 'r+b') as f:
+        f.seek((newest.sequence % 2) * 64 + 16)
+        f.write(b'\0' * 16)
+    loaded = PositionJournal(path).load()
+    if loaded != previous:
+        raise RuntimeError(f"torn write: loaded {loaded}, expected {previous}")
+    print(f"torn write: fell back to sequence {loaded.sequence} ({loaded.angle} deg)")
+
+
+def _restart(journal_file, home_offset_file):
+    # A fresh process: new GPIO, the simulated table back where the stepper counter starts
+    gpio = SimulatedGPIO()
+    driver = StepperDriver(gpio, 18, 19, hall_pin=6, home_offset_file=home_offset_file)
+    table = Turntable("bench", driver, journal_file=journal_file)
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        table.restore_position()
+    return table, time.perf_counter() - started
+
+
+def _turn(table, angle):
+    # As the table's worker runs a turn job, journal write included
+    job = MotionJob(1, angle)
+    job.started = time.time()
+    with contextlib.redirect_stdout(io.StringIO()):
+        table.execute_job(job)
+
+
+def _shutdown(table, clean):
+    with contextlib.redirect_stdout(io.StringIO()):
+        if clean:
+            table.close()
+        else:
+            # A crash: the journal keeps the running state of the last move
+            table.driver.close()
+            table.journal.close(clean=False)
+
+
+def _restarts(directory):
+    journal_file = os.path.join(directory, 'position_journal.bin')
+    home_offset_file = os.path.join(directory, 'home_offset.json')
+    table, elapsed = _restart(journal_file, home_offset_file)
+    if not table.homed:
+        raise RuntimeError("first start did not home")
+    print(f"first start: homed in {elapsed * 1e3:.0f} ms")
+    _turn(table, 45)
+    steps = table.current_steps
+    _shutdown(table, clean=True)
+    if PositionJournal(journal_file).load().state != STATE_CLEAN:
+        raise RuntimeError("clean shutdown did not mark the journal clean")
+
+    table, elapsed = _restart(journal_file, home_offset_file)
+    if table.current_steps != steps or table.driver.simulated.position != 0:
+        raise RuntimeError(f"clean restart: at {table.current_steps} steps (journal {steps}), "
+                           f"table moved {table.driver.simulated.position} steps")
+    print(f"restart after a clean shutdown: resumed at {table.current_angle:.2f} deg "
+          f"in {elapsed * 1e3:.1f} ms without moving")
+    _turn(table, 45)
+    _shutdown(table, clean=False)
+
+    table, elapsed = _restart(journal_file, home_offset_file)
+    if not table.homed or table.driver.simulated.position == 0:
+        raise RuntimeError("restart after a crash did not home")
+    print(f"restart after a crash: homed in {elapsed * 1e3:.0f} ms")
+    _shutdown(table, clean=True)
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        _torn_write(os.path.join(directory, 'torn.bin'))
+        _restarts(directory)
+
+
+if __name__ == "__main__":
+    main()
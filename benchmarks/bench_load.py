@@ -0,0 +1,339 @@
+"""Load test of the ZMQ turntable service with many concurrent clients.
+
+Starts TurnTableService.main() in-process on simulated hardware (or
+targets a running service with --connect) and plays --clients clients,
+each sending {"action": "turn", "angle": ...} commands at --rate per
+second for --duration seconds. Commands can instead be replayed from a
+JSONL trace (--replay), one command per line with optional "t" (seconds
+from the start) and "client" keys; --record writes such a trace of the
+generated load.
+
+With --transport router every client has its own DEALER socket and
+matches its acks and results by correlation id. With --transport pub
+the clients share one PUB socket, the way the SUB command channel is
+used, and acks are matched to commands in order from the status stream;
+that needs every command to be acknowledged there, so replay traces with
+cancel, stop or spin_stop over the router.
+Reported: throughput, ack and completion latency percentiles, rejected
+commands and commands that were never acked (dropped) or never finished.
+
+    python -m benchmarks.bench_load [--clients N] [--rate R] [--duration S]
+        [--angle DEG] [--transport router|pub] [--replay FILE] [--record FILE]
+
+The clients share the interpreter (and its GIL) with an in-process
+service; use --connect to load a service running in its own process.
+"""
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+os.environ.setdefault('TURNTABLE_GPIO', 'sim')
+
+import zmq  # noqa: E402
+
+import TurnTableService  # noqa: E402
+from metrics import Histogram  # noqa: E402
+
+FINAL = ("completed", "cancelled", "error")
+
+
+def load_trace(path):
+    # (t or None, client or None, command) per line; blank lines and # comments are skipped
+    trace = []
+    with open(path) as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            command = json.loads(line)
+            if not isinstance(command, dict) or "action" not in command:
+                raise ValueError("%s:%d: expected a json command with an \"action\"" % (path, number))
+            trace.append((command.pop("t", None), command.pop("client", None), command))
+    return trace
+
+
+def generate(args):
+    # Open-loop schedule: each client sends at its rate whether or not earlier commands were answered
+    trace = []
+    rng = random.Random(args.seed)
+    devices = args.device or [None]
+    for client in range(args.clients):
+        t = rng.uniform(0, 1.0 / args.rate)
+        while t < args.duration:
+            command = {"action": "turn", "angle": args.angle}
+            device = devices[(client + len(trace)) % len(devices)]
+            if device is not None:
+                command["device"] = device
+            trace.append((t, client, command))
+            t += rng.expovariate(args.rate) if args.poisson else 1.0 / args.rate
+    return trace
+
+
+def schedule(trace, clients, rate):
+    # Commands per client in send order; lines of a replayed trace without "t" follow each other at rate
+    per_client = [[] for _ in range(clients)]
+    untimed = itertools.count()
+    for index, (t, client, command) in enumerate(trace):
+        client = index % clients if client is None else client % clients
+        if t is None:
+            t = next(untimed) / rate
+        per_client[client].append((t, command))
+    for commands in per_client:
+        commands.sort(key=lambda item: item[0])
+    return per_client
+
+
+class Results:
+    """Latencies (microseconds) and outcome counts, shared by the client threads."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ack = Histogram()
+        self.complete = Histogram()
+        self.sent = self.acked = self.rejected = self.queued = self.finished = self.failed = 0
+        self.last_ack = self.last_result = 0.0
+
+    def on_ack(self, sent_at, now, status):
+        with self.lock:
+            self.ack.record((now - sent_at) * 1e6)
+            self.last_ack = now
+            if status == "error":
+                self.rejected += 1
+            else:
+                self.acked += 1
+                self.queued += status == "queued"
+
+    def on_result(self, sent_at, now, status):
+        with self.lock:
+            self.complete.record((now - sent_at) * 1e6)
+            self.last_result = now
+            self.finished += 1
+            if status != "completed":
+                self.failed += 1
+
+
+def run_router(endpoint, per_client, results, start, drain):
+    # One DEALER per client thread; replies carry the correlation id of the command
+    context = zmq.Context.instance()
+
+    def client(commands):
+        socket = context.socket(zmq.DEALER)
+        socket.setsockopt(zmq.LINGER, 0)
+        socket.connect(endpoint)
+        sent_at = {}  # commands still waiting for an ack, or for the result of their job
+        position = 0
+        deadline = None
+        while True:
+            now = time.perf_counter()
+            while position < len(commands) and start + commands[position][0] <= now:
+                command = dict(commands[position][1], id=position)
+                socket.send(json.dumps(command).encode())
+                sent_at[position] = time.perf_counter()
+                position += 1
+                with results.lock:
+                    results.sent += 1
+            if position == len(commands):
+                if deadline is None:
+                    deadline = now + drain
+                if not sent_at or now >= deadline:
+                    break
+                timeout = deadline - now
+            else:
+                timeout = start + commands[position][0] - now
+            if not socket.poll(max(timeout, 0) * 1000):
+                continue
+            while True:
+                try:
+                    reply = json.loads(socket.recv(zmq.NOBLOCK))
+                except zmq.Again:
+                    break
+                now = time.perf_counter()
+                if reply["reply"] == "ack":
+                    sent = sent_at.get(reply["id"])
+                    if sent is None:
+                        continue
+                    results.on_ack(sent, now, reply["status"])
+                    if reply["status"] != "queued":
+                        del sent_at[reply["id"]]
+                elif reply["id"] in sent_at:
+                    results.on_result(sent_at.pop(reply["id"]), now, reply["status"])
+        socket.close()
+
+    threads = [threading.Thread(target=client, args=(commands,), daemon=True) for commands in per_client]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def run_pub(commands_socket, status, per_client, results, start, drain):
+    # The clients share the command PUB socket; the service acks in the order it receives, so
+    # acks ("queued", or an "error" that names no job) are matched to commands first in, first out.
+    lock = threading.Lock()
+    unacked = []  # send times, in send order
+    jobs = {}  # (device, job) -> send time
+    done = threading.Event()
+
+    def client(commands):
+        for t, command in commands:
+            delay = start + t - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            payload = json.dumps(command)
+            with lock:
+                commands_socket.send_string(payload)
+                unacked.append(time.perf_counter())
+                results.sent += 1
+
+    def receive():
+        acked = 0
+        deadline = None
+        while True:
+            now = time.perf_counter()
+            if done.is_set():
+                if deadline is None:
+                    deadline = now + drain
+                with lock:
+                    pending = len(unacked) - acked
+                if (not pending and not jobs) or now >= deadline:
+                    return
+            if not status.poll(100):
+                continue
+            message = json.loads(status.recv_multipart()[-1])
+            now = time.perf_counter()
+            name = message.get("status")
+            key = (message.get("device"), message.get("job"))
+            if name == "queued" or (name == "error" and "job" not in message):
+                with lock:
+                    if acked >= len(unacked):
+                        continue
+                    sent = unacked[acked]
+                acked += 1
+                results.on_ack(sent, now, name)
+                if name == "queued":
+                    jobs[key] = sent
+            elif name in FINAL and key in jobs:
+                results.on_result(jobs.pop(key), now, name)
+                for merged in message.get("merged", []):
+                    sent = jobs.pop((key[0], merged), None)
+                    if sent is not None:
+                        results.on_result(sent, now, name)
+
+    receiver = threading.Thread(target=receive, daemon=True)
+    receiver.start()
+    threads = [threading.Thread(target=client, args=(commands,), daemon=True) for commands in per_client]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    done.set()
+    receiver.join()
+
+
+def _report(name, histogram, out):
+    summary = histogram.summary()
+    print(f"{name:16} p50 {histogram.percentile(50) / 1e3:8.2f} ms  p90 {histogram.percentile(90) / 1e3:8.2f} ms  "
+          f"p99 {histogram.percentile(99) / 1e3:8.2f} ms  p99.9 {histogram.percentile(99.9) / 1e3:8.2f} ms  "
+          f"max {summary['max'] / 1e3:8.2f} ms", file=out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=8, help="concurrent clients")
+    parser.add_argument('--rate', type=float, default=50.0, help="commands per second per client")
+    parser.add_argument('--duration', type=float, default=5.0, help="seconds of generated load")
+    parser.add_argument('--poisson', action='store_true', help="exponential gaps instead of a fixed interval")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--angle', type=float, default=0.0, help="angle per turn (0: no motion)")
+    parser.add_argument('--device', action='append', help="table ids to spread commands over (repeatable)")
+    parser.add_argument('--transport', choices=('router', 'pub'), default='router')
+    parser.add_argument('--replay', help="JSONL command trace to send instead of generated turns")
+    parser.add_argument('--record', help="write the commands sent as a JSONL trace")
+    parser.add_argument('--drain', type=float, default=10.0, help="seconds to wait for outstanding replies")
+    parser.add_argument('--queue', type=int, default=TurnTableService.MAX_QUEUED_JOBS,
+                        help="service job queue limit (in-process service only)")
+    parser.add_argument('--connect', help="host of a running service instead of starting one")
+    parser.add_argument('--command-port', type=int, default=19944)
+    parser.add_argument('--status-port', type=int, default=19954)
+    parser.add_argument('--router-port', type=int, default=19964)
+    parser.add_argument('--json', action='store_true', help="print the results as json")
+    args = parser.parse_args()
+
+    trace = load_trace(args.replay) if args.replay else generate(args)
+    per_client = schedule(trace, args.clients, args.rate)
+    if args.record:
+        with open(args.record, 'w') as f:
+            for client, commands in enumerate(per_client):
+                for t, command in commands:
+                    f.write(json.dumps(dict(command, t=round(t, 6), client=client)) + "\n")
+
+    host = args.connect or "127.0.0.1"
+    context = zmq.Context.instance()
+    # A remote service connects its SUB socket to us, so listen on every interface then
+    commands = context.socket(zmq.PUB)
+    commands.bind("tcp://%s:%d" % ("*" if args.connect else "127.0.0.1", args.command_port))
+    status = context.socket(zmq.SUB)
+    status.connect("tcp://%s:%d" % (host, args.status_port))
+    status.setsockopt(zmq.SUBSCRIBE, b"")
+
+    # The service prints every message it receives; keep that out of the report.
+    out = sys.stdout
+    contextlib.redirect_stdout(io.StringIO()).__enter__()
+    if args.connect is None:
+        TurnTableService.MAX_QUEUED_JOBS = args.queue
+        threading.Thread(target=TurnTableService.main, daemon=True,
+                         args=("127.0.0.1", args.command_port, args.status_port, args.router_port)).start()
+        while True:
+            message = json.loads(status.recv_multipart()[-1])
+            if message["status"] == "ready":
+                break
+    if args.transport == 'pub':
+        # Wait until the service's subscription to our commands is through: it answers a ping with an error.
+        while True:
+            commands.send_string(json.dumps({"action": "ping"}))
+            if status.poll(200):
+                break
+        time.sleep(0.2)
+    while status.poll(0):
+        status.recv_multipart()
+
+    results = Results()
+    start = time.perf_counter()
+    if args.transport == 'router':
+        status.close()
+        run_router("tcp://%s:%d" % (host, args.router_port), per_client, results, start, args.drain)
+    else:
+        run_pub(commands, status, per_client, results, start, args.drain)
+    last = max(results.last_ack, results.last_result, start)
+    elapsed = last - start
+    dropped = results.sent - results.acked - results.rejected
+    unfinished = results.queued - results.finished
+
+    if args.json:
+        print(json.dumps({
+            "transport": args.transport, "clients": args.clients, "sent": results.sent,
+            "acked": results.acked, "rejected": results.rejected, "dropped": dropped,
+            "finished": results.finished, "failed": results.failed, "unfinished": unfinished,
+            "elapsed": elapsed, "ack_us": results.ack.summary(), "complete_us": results.complete.summary(),
+        }), file=out)
+        return
+    span = max(t for commands in per_client for t, _ in commands) if trace else 0.0
+    print(f"{args.transport}: {args.clients} clients, {results.sent} commands over {span:.2f} s "
+          f"({results.sent / span if span else 0:.0f}/s offered)", file=out)
+    print(f"acked {results.acked} ({results.acked / elapsed if elapsed else 0:.0f}/s), "
+          f"rejected {results.rejected}, dropped {dropped}", file=out)
+    print(f"finished {results.finished} ({results.finished / elapsed if elapsed else 0:.0f}/s), "
+          f"not completed {results.failed}, unfinished {unfinished}", file=out)
+    _report("ack latency", results.ack, out)
+    _report("complete latency", results.complete, out)
+
+
+if __name__ == "__main__":
+    main()
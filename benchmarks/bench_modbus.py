@@ -0,0 +1,57 @@
+"""Modbus RTU transactions per second against simulated drives.
+
+Runs read and write transactions through ModbusRtuSession on a
+"sim://" port (sim_devices) with wire timing for the given baud rate,
+and a full servo move: shadow-planned writes plus motion monitoring.
+
+    python -m benchmarks.bench_modbus [--baudrate B] [--count N]
+"""
+import argparse
+import time
+
+from modbus_rtu import ModbusRtuSession
+from motion_monitor import MotionMonitor
+from register_map import RegisterPlanner
+from sim_devices import SIM_STATUS_ADDRESS, SIM_STATUS_IN_POSITION
+
+
+def _rate(label, count, function):
+    started = time.perf_counter()
+    for _ in range(count):
+        result = function()
+        if result is None or result is False:
+            raise RuntimeError(f"{label}: transaction failed")
+    elapsed = time.perf_counter() - started
+    print(f"{label:<24} {count / elapsed:8.1f} tx/s  {elapsed / count * 1e3:7.2f} ms/tx")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--baudrate', type=int, default=9600)
+    parser.add_argument('--count', type=int, default=50)
+    args = parser.parse_args()
+
+    with ModbusRtuSession('sim://bench-modbus', args.baudrate) as session:
+        _rate("read 1 register", args.count, lambda: session.read_register(1, 0x0606))
+        _rate("read feedback (2 regs)", args.count, lambda: session.read_multiple_registers(1, 0x0012, 2))
+        _rate("write single", args.count, lambda: session.write_single_register(1, 0x0528, 3000))
+        _rate("write multiple (4 regs)", args.count,
+              lambda: session.write_multiple_registers(1, 0x0604, [130, 0, 1000, 0]))
+
+        planner = RegisterPlanner(session, 1)
+        monitor = MotionMonitor(session, 1, status_address=SIM_STATUS_ADDRESS,
+                                in_position_bit=SIM_STATUS_IN_POSITION)
+        for angle in (10, 10, 90):
+            pulses = int(angle * 30 / 360 * 100000)
+            started = time.perf_counter()
+            start_pulses = monitor.read_feedback()
+            frames = planner.write([('servo_on', 1), ('accel_decel_ms', 100), ('speed_rpm', 20000),
+                                    ('pr_mode', 130), ('target_pulses', pulses), ('trigger', 1)])
+            commanded = time.perf_counter() - started
+            result = monitor.wait(start_pulses + pulses, start_pulses, timeout=30)
+            print(f"move {angle:>3} deg: {len(frames)} frames, command {commanded * 1e3:6.1f} ms, "
+                  f"{result.reason} after {(time.perf_counter() - started):.3f} s, angle {result.angle:.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Per-move latency of the stepper path on simulated hardware.
+
+Runs TurnTableService.rotate() with the simulated GPIO and table and
+compares the wall time of each move with its planned profile duration.
+Then stops moves partway and fails unless the driver counted exactly the
+steps the table made and the next full move is exact.
+
+    python -m benchmarks.bench_move [--angles 10,45,90,180]
+"""
+import argparse
+import contextlib
+import io
+import os
+import threading
+import time
+
+os.environ.setdefault('TURNTABLE_GPIO', 'sim')
+
+import motion_profile  # noqa: E402
+import TurnTableService  # noqa: E402
+
+
+def _planned(angle):
+    steps = int(abs(angle) * (12800 / 360))
+    return steps, motion_profile.profile_duration(motion_profile.step_delays(
+        steps, TurnTableService.MAX_SPEED, TurnTableService.ACCELERATION,
+        TurnTableService.START_SPEED, TurnTableService.MOTION_PROFILE))
+
+
+def _stopped_move(table, driver, angle, fraction):
+    steps, planned = _planned(angle)
+    position, counted = table.position, driver.steps
+    timer = threading.Timer(planned * fraction, driver.stop)
+    timer.start()
+    with contextlib.redirect_stdout(io.StringIO()):
+        moved = TurnTableService.rotate(angle)
+    timer.join()
+    driver.arm()
+    if not 0 < moved < steps:
+        raise RuntimeError(f"move stopped at {fraction:.0%} made {moved} of {steps} steps")
+    if table.position - position != moved or driver.steps - counted != moved:
+        raise RuntimeError(f"stopped move: table moved {table.position - position} steps, "
+                           f"driver counted {driver.steps - counted}, rotate returned {moved}")
+    print(f"stopped at {fraction:>4.0%}: {moved:>5} of {steps} steps, driver and table agree")
+    # A pulse left high by the stop would swallow the first step of the next move
+    position = table.position
+    with contextlib.redirect_stdout(io.StringIO()):
+        TurnTableService.rotate(angle)
+    if table.position - position != steps:
+        raise RuntimeError(f"move after a stop: table moved {table.position - position} steps, expected {steps}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--angles', default='10,45,90,180')
+    parser.add_argument('--repeat', type=int, default=2)
+    args = parser.parse_args()
+
+    TurnTableService.init_hardware()
+    table = TurnTableService.simulated_table
+    print(f"{'angle':>6} {'steps':>6} {'planned':>9} {'actual':>9} {'overhead':>9}")
+    for angle in [float(value) for value in args.angles.split(',')]:
+        for _ in range(args.repeat):
+            steps, planned = _planned(angle)
+            position = table.position
+            started = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                TurnTableService.rotate(angle)
+            actual = time.perf_counter() - started
+            if table.position - position != steps:
+                raise RuntimeError(f"table moved {table.position - position} steps, expected {steps}")
+            print(f"{angle:>6.1f} {steps:>6} {planned * 1e3:>7.1f}ms {actual * 1e3:>7.1f}ms "
+                  f"{(actual - planned) * 1e3:>7.1f}ms")
+    for fraction in (0.25, 0.5, 0.75):
+        _stopped_move(table, TurnTableService.table.driver, 180, fraction)
+    TurnTableService.get_step_backend().close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""Correlation of acks and results on the service's ROUTER endpoint.
+
+Starts TurnTableService.main() in-process on simulated hardware and runs
+several DEALER clients at once, all using the same correlation ids, with
+short turns and a malformed command each. Fails unless every client gets
+exactly one ack per command it sent, one result per queued job carrying
+the job id its ack named, and nothing meant for another client. Reports
+the ack and result latencies.
+
+    python -m benchmarks.bench_router [--clients N] [--turns N]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import threading
+import time
+
+os.environ.setdefault('TURNTABLE_GPIO', 'sim')
+
+import zmq  # noqa: E402
+
+import TurnTableService  # noqa: E402
+
+
+def _client(endpoint, turns, replies):
+    socket = zmq.Context.instance().socket(zmq.DEALER)
+    socket.setsockopt(zmq.LINGER, 0)
+    socket.connect(endpoint)
+    sent_at = {}
+    for i in range(turns):
+        sent_at[i] = time.perf_counter()
+        socket.send(json.dumps({"id": i, "action": "turn", "angle": 1}).encode())
+    sent_at["bad"] = time.perf_counter()
+    socket.send(json.dumps({"id": "bad", "action": "turn", "angle": "x"}).encode())
+    expected = turns + 1 + turns  # an ack per command, a result per turn
+    deadline = time.monotonic() + 30
+    while len(replies) < expected and time.monotonic() < deadline:
+        if socket.poll(1000):
+            reply = json.loads(socket.recv())
+            reply["latency"] = time.perf_counter() - sent_at.get(reply["id"], float('nan'))
+            replies.append(reply)
+    # Anything further would be a duplicate, or a reply for another client
+    while socket.poll(200):
+        replies.append(json.loads(socket.recv()))
+    socket.close()
+
+
+def _check(client, replies, turns):
+    acks = {}
+    results = {}
+    for reply in replies:
+        if reply["id"] not in list(range(turns)) + ["bad"]:
+            raise RuntimeError(f"client {client} got a reply for id {reply['id']!r} it never sent")
+        seen = acks if reply["reply"] == "ack" else results
+        if reply["id"] in seen:
+            raise RuntimeError(f"client {client} got a second {reply['reply']} for id {reply['id']!r}")
+        seen[reply["id"]] = reply
+    if set(acks) != set(range(turns)) | {"bad"} or acks["bad"]["status"] != "error":
+        raise RuntimeError(f"client {client} acks: {sorted(map(str, acks))}, bad command {acks.get('bad')}")
+    for i in range(turns):
+        if acks[i]["status"] != "queued":
+            raise RuntimeError(f"client {client} turn {i} acked {acks[i]['status']}")
+        result = results.get(i)
+        if result is None or result["job"] != acks[i]["job"] or result["status"] != "completed":
+            raise RuntimeError(f"client {client} turn {i} (job {acks[i]['job']}) got result {result}")
+    return [acks[i]["job"] for i in range(turns)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=3)
+    parser.add_argument('--turns', type=int, default=4, help="1 degree turns per client")
+    parser.add_argument('--command-port', type=int, default=19945)
+    parser.add_argument('--status-port', type=int, default=19955)
+    parser.add_argument('--router-port', type=int, default=19965)
+    args = parser.parse_args()
+    if args.clients * args.turns > TurnTableService.MAX_QUEUED_JOBS:
+        parser.error("more turns than the service queues (MAX_QUEUED_JOBS)")
+
+    status = zmq.Context.instance().socket(zmq.SUB)
+    status.connect("tcp://127.0.0.1:%d" % args.status_port)
+    status.setsockopt(zmq.SUBSCRIBE, b"")
+
+    # The service prints every message it receives; keep that out of the report.
+    out = sys.stdout
+    contextlib.redirect_stdout(io.StringIO()).__enter__()
+    threading.Thread(target=TurnTableService.main, daemon=True,
+                     args=("127.0.0.1", args.command_port, args.status_port, args.router_port)).start()
+    while json.loads(status.recv_multipart()[-1])["status"] != "ready":
+        pass
+    status.close()
+
+    endpoint = "tcp://127.0.0.1:%d" % args.router_port
+    replies = [[] for _ in range(args.clients)]
+    threads = [threading.Thread(target=_client, args=(endpoint, args.turns, replies[client]), daemon=True)
+               for client in range(args.clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    jobs = []
+    for client in range(args.clients):
+        jobs += _check(client, replies[client], args.turns)
+    if len(set(jobs)) != len(jobs):
+        raise RuntimeError(f"one job acked to several clients: {sorted(jobs)}")
+    acks = sorted(reply["latency"] for client in replies for reply in client if reply["reply"] == "ack")
+    results = sorted(reply["latency"] for client in replies for reply in client if reply["reply"] == "result")
+    print(f"{args.clients} clients with the same ids: {len(acks)} acks and {len(results)} results, "
+          f"each to its own client", file=out)
+    print(f"ack p50 {acks[len(acks) // 2] * 1e3:.2f} ms, result p50 {results[len(results) // 2] * 1e3:.0f} ms, "
+          f"last result {results[-1] * 1e3:.0f} ms", file=out)
+
+
+if __name__ == "__main__":
+    main()
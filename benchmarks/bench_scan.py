@@ -0,0 +1,105 @@
+"""Scan jobs on a simulated stepper table.
+
+Runs scans through a table's worker as the service does and fails unless
+every stop is reported once, in order and on its target angle, the
+capture pin pulses at each stop and the driver's count matches the
+simulated table. A scan stopped partway must end cancelled with the count
+still matching. Reports the time per stop.
+
+    python -m benchmarks.bench_scan [--stops N] [--dwell S]
+"""
+import argparse
+import threading
+import time
+
+import scan_plan
+from devices import Turntable
+from drivers import StepperDriver
+from sim_devices import SimulatedGPIO
+
+CAPTURE_PIN = 24
+
+
+class _Events:
+    # Stands in for the StatusPublisher: keeps every status the table publishes
+    def __init__(self):
+        self.events = []
+        self.changed = threading.Condition()
+
+    def publish(self, status, **fields):
+        with self.changed:
+            self.events.append((status, fields))
+            self.changed.notify_all()
+
+    def wait_for(self, condition, what, timeout=30.0):
+        with self.changed:
+            if not self.changed.wait_for(lambda: condition(self.events), timeout):
+                raise RuntimeError("timed out waiting for " + what)
+
+    def of(self, status):
+        with self.changed:
+            return [fields for event, fields in self.events if event == status]
+
+
+def _ended(job):
+    return lambda events: any(event in ("completed", "cancelled", "error") and fields["job"] == job.id
+                              for event, fields in events)
+
+
+def _stops(events, job):
+    return [stop for stop in events.of("at_angle") if stop["job"] == job.id]
+
+
+def _run(table, events, plan, stop_after=None):
+    position, counted = table.driver.simulated.position, table.driver.steps
+    started = time.perf_counter()
+    job = table.scheduler.submit(None, action="scan", plan=plan)
+    if stop_after is not None:
+        events.wait_for(lambda _: len(_stops(events, job)) >= stop_after, f"{stop_after} stops")
+        table.scheduler.stop()
+    events.wait_for(_ended(job), "the scan to end")
+    elapsed = time.perf_counter() - started
+    moved = table.driver.simulated.position - position
+    if table.driver.steps - counted != moved:
+        raise RuntimeError(f"scan: driver counted {table.driver.steps - counted} steps, table moved {moved}")
+    return job, _stops(events, job), elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--stops', type=int, default=8)
+    parser.add_argument('--dwell', type=float, default=0.05, help="seconds held at each stop")
+    args = parser.parse_args()
+
+    gpio = SimulatedGPIO()
+    driver = StepperDriver(gpio, 18, 19, hall_pin=6, capture_pin=CAPTURE_PIN)
+    captures = []
+    gpio.watch(CAPTURE_PIN, lambda pin, level: level == gpio.HIGH and captures.append(pin))
+    table = Turntable("bench", driver)
+    events = _Events()
+    table.start(events)
+
+    plan = scan_plan.parse_plan({"stops": args.stops, "dwell": args.dwell, "capture": True}, table.current_angle)
+    job, stops, elapsed = _run(table, events, plan)
+    if job.status != "completed" or [stop["seq"] for stop in stops] != list(range(args.stops)):
+        raise RuntimeError(f"scan {job.status} with stops {[stop['seq'] for stop in stops]}")
+    step_angle = 360.0 / driver.steps_per_revolution
+    for stop in stops:
+        off = (stop["angle"] - stop["target"] + 180) % 360 - 180
+        if abs(off) > step_angle:
+            raise RuntimeError(f"stop {stop['seq']} at {stop['angle']} deg, target {stop['target']}")
+    if len(captures) != args.stops:
+        raise RuntimeError(f"capture pin pulsed {len(captures)} times for {args.stops} stops")
+    print(f"scan of {args.stops} stops: all on target, {len(captures)} captures, "
+          f"{elapsed / args.stops * 1e3:.0f} ms per stop with {args.dwell * 1e3:.0f} ms dwell")
+
+    plan = scan_plan.parse_plan({"stops": args.stops, "dwell": 0.2}, table.current_angle)
+    job, stops, elapsed = _run(table, events, plan, stop_after=2)
+    if job.status != "cancelled" or not 2 <= len(stops) < args.stops:
+        raise RuntimeError(f"stopped scan ended {job.status} after {len(stops)} stops")
+    print(f"scan stopped after 2 stops: cancelled after {len(stops)}, driver and table agree")
+    table.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""Motion scheduler queueing, cancellation and coalescing.
+
+Runs MotionScheduler with a stand-in move that blocks until it is
+released or aborted, and fails when a queued job that was cancelled
+still runs, stop() leaves the running job untouched, the queue limit is
+not enforced or queued turns are not merged with coalesce=True. Also
+reports how long submit() takes while a move runs.
+
+    python -m benchmarks.bench_scheduler [--count N]
+"""
+import argparse
+import threading
+import time
+
+from motion_scheduler import MotionScheduler
+
+
+class _Moves:
+    # execute/abort for the scheduler: each move waits for release() or abort()
+    def __init__(self):
+        self.executed = []
+        self.events = []
+        self.running = threading.Event()
+        self._release = threading.Event()
+        self._aborted = threading.Event()
+
+    def execute(self, job):
+        self.executed.append(job)
+        self.running.set()
+        while not self._release.wait(0.001):
+            if self._aborted.is_set():
+                self._aborted.clear()
+                self.running.clear()
+                return
+        self._release.clear()
+
+    def abort(self):
+        self._aborted.set()
+
+    def release(self):
+        self.running.clear()
+        self._release.set()
+
+    def on_event(self, event, job):
+        self.events.append((event, job.id))
+
+
+def _wait_for(condition, what, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise RuntimeError("timed out waiting for " + what)
+        time.sleep(0.001)
+
+
+def _cancel_and_stop(count):
+    moves = _Moves()
+    scheduler = MotionScheduler(moves.execute, moves.on_event, abort=moves.abort, max_queue=count)
+    running = scheduler.submit(10)
+    moves.running.wait(5)
+    started = time.perf_counter()
+    queued = [scheduler.submit(10) for _ in range(count)]
+    submit_us = (time.perf_counter() - started) / count * 1e6
+    if any(job is None for job in queued) or scheduler.submit(10) is not None:
+        raise RuntimeError(f"queue limit of {count} not enforced")
+    print(f"submit behind a running move: {submit_us:.1f} us per job, {count} queued, next one refused")
+
+    dropped = queued[count // 2]
+    if scheduler.cancel(dropped.id) != [dropped] or dropped.status != "cancelled":
+        raise RuntimeError(f"cancel of job {dropped.id} failed: {dropped.status}")
+    cancelled, current = scheduler.stop()
+    if current is not running or len(cancelled) != count - 1:
+        raise RuntimeError(f"stop cancelled {len(cancelled)} queued jobs and interrupted {current}")
+    _wait_for(lambda: not scheduler.busy, "the stopped move to end")
+    if running.status != "cancelled" or ("cancelled", running.id) not in moves.events:
+        raise RuntimeError(f"stopped move ended {running.status}")
+    if moves.executed != [running]:
+        raise RuntimeError(f"cancelled jobs ran: {[job.id for job in moves.executed]}")
+    print(f"cancel one, stop the rest: {len(cancelled) + 1} queued jobs dropped, running move interrupted")
+
+    after = scheduler.submit(10)
+    _wait_for(moves.running.is_set, "the next job to start")
+    moves.release()
+    _wait_for(lambda: after.status == "completed", "the next job to complete")
+    scheduler.close(5)
+
+
+def _coalesce():
+    moves = _Moves()
+    scheduler = MotionScheduler(moves.execute, moves.on_event, abort=moves.abort, coalesce=True)
+    first = scheduler.submit(5)
+    moves.running.wait(5)
+    turns = [scheduler.submit(angle) for angle in (10, 20, 30)]
+    scan = scheduler.submit(None, action="scan", plan=[])
+    moves.release()
+    _wait_for(lambda: len(moves.executed) == 2, "the merged turn to start")
+    merged = moves.executed[1]
+    if merged is not turns[0] or merged.angle != 60 or merged.merged != turns[1:]:
+        raise RuntimeError(f"turns not coalesced: ran job {merged.id} with angle {merged.angle}, "
+                           f"merged {[job.id for job in merged.merged]}")
+    moves.release()
+    _wait_for(lambda: len(moves.executed) == 3, "the scan to start")
+    moves.release()
+    _wait_for(lambda: not scheduler.busy, "the queue to drain")
+    if first.status != "completed" or scan.status != "completed":
+        raise RuntimeError("jobs around the merged turn did not complete")
+    print("coalesce: 3 queued turns ran as one 60 deg move, the scan behind them on its own")
+    scheduler.close(5)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--count', type=int, default=16, help="jobs queued behind the running move")
+    args = parser.parse_args()
+
+    _cancel_and_stop(args.count)
+    _coalesce()
+
+
+if __name__ == "__main__":
+    main()
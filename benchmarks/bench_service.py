@@ -0,0 +1,119 @@
+"""Commands per second through the ZMQ turntable service.
+
+Starts TurnTableService.main() in-process on simulated hardware with
+local endpoints, plays the client side (PUB for commands, SUB for
+status) and measures ack latency, command throughput and completion of
+a burst of turn commands.
+
+    python -m benchmarks.bench_service [--count N] [--angle DEG]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import threading
+import time
+
+os.environ.setdefault('TURNTABLE_GPIO', 'sim')
+
+import zmq  # noqa: E402
+
+import TurnTableService  # noqa: E402
+
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[int(fraction * (len(values) - 1))] if values else float('nan')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--count', type=int, default=200, help="turn commands in the burst")
+    parser.add_argument('--angle', type=float, default=0.0, help="angle per turn (0: no motion)")
+    parser.add_argument('--queue', type=int, default=TurnTableService.MAX_QUEUED_JOBS,
+                        help="service job queue limit")
+    parser.add_argument('--command-port', type=int, default=19944)
+    parser.add_argument('--status-port', type=int, default=19954)
+    args = parser.parse_args()
+
+    context = zmq.Context.instance()
+    commands = context.socket(zmq.PUB)
+    commands.bind("tcp://127.0.0.1:%d" % args.command_port)
+    status = context.socket(zmq.SUB)
+    status.connect("tcp://127.0.0.1:%d" % args.status_port)
+    status.setsockopt(zmq.SUBSCRIBE, b"")
+
+    TurnTableService.MAX_QUEUED_JOBS = args.queue
+
+    # The service prints every message it receives; keep that out of the report.
+    out = sys.stdout
+    contextlib.redirect_stdout(io.StringIO()).__enter__()
+    threading.Thread(target=TurnTableService.main, daemon=True,
+                     args=("127.0.0.1", args.command_port, args.status_port)).start()
+
+    # The service announces itself with "ready" once it has seen our subscription.
+    while True:
+        message = json.loads(status.recv_multipart()[-1])
+        if message["status"] == "ready":
+            print(f"service ready after {message['startup'] * 1e3:.0f} ms", file=out)
+            break
+    # Its subscription to our commands may still be in flight: it answers an unknown action with an error.
+    while True:
+        commands.send_string(json.dumps({"action": "ping"}))
+        if status.poll(200):
+            break
+    time.sleep(0.2)
+    while status.poll(0):
+        status.recv_multipart()
+
+    sent_at = {}
+    ack_latency = []
+    done_latency = []
+    completed = 0
+    rejected = 0
+    started = time.perf_counter()
+    for i in range(args.count):
+        commands.send_string(json.dumps({"action": "turn", "angle": args.angle}))
+        sent_at[i] = time.perf_counter()
+    acks = 0
+    job_sent = {}
+    # A turn of 0 deg can finish before the listener has published its "queued": the two come
+    # from different threads, so such completions wait here for their ack
+    early = {}
+    deadline = time.perf_counter() + 60
+    while (acks + rejected < args.count or completed < acks) and time.perf_counter() < deadline:
+        if not status.poll(1000):
+            continue
+        frames = status.recv_multipart()
+        now = time.perf_counter()
+        message = json.loads(frames[-1])
+        if message["status"] == "queued":
+            job_sent[message["job"]] = sent_at[acks + rejected]
+            ack_latency.append(now - job_sent[message["job"]])
+            acks += 1
+            if message["job"] in early:
+                done_latency.append(early.pop(message["job"]) - job_sent[message["job"]])
+        elif message["status"] == "error" and message.get("reason") == "queue full":
+            rejected += 1
+        elif message["status"] == "completed":
+            for job in [message["job"]] + message.get("merged", []):
+                if job in job_sent:
+                    done_latency.append(now - job_sent[job])
+                else:
+                    early[job] = now
+                completed += 1
+    elapsed = time.perf_counter() - started
+
+    print(f"{args.count} commands in {elapsed:.3f} s: {args.count / elapsed:.0f} commands/s", file=out)
+    print(f"acked {acks}, rejected (queue full) {rejected}, completed {completed}, "
+          f"lost {args.count - acks - rejected}", file=out)
+    print(f"ack latency      p50 {_percentile(ack_latency, 0.5) * 1e3:7.2f} ms  "
+          f"p99 {_percentile(ack_latency, 0.99) * 1e3:7.2f} ms", file=out)
+    print(f"complete latency p50 {_percentile(done_latency, 0.5) * 1e3:7.2f} ms  "
+          f"p99 {_percentile(done_latency, 0.99) * 1e3:7.2f} ms", file=out)
+
+
+if __name__ == "__main__":
+    main()
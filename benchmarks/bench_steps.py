@@ -0,0 +1,42 @@
+"""Step waveform throughput and jitter on the simulated backend.
+
+Plays moves through step_engine.SimulatedBackend with real timing and
+reports how late the edges were against the compiled schedule.
+
+    python -m benchmarks.bench_steps [--steps N] [--delay S]
+"""
+import argparse
+import time
+
+import step_engine
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--steps', type=int, default=3200, help="steps per move (3200 = 90 deg)")
+    parser.add_argument('--delay', type=float, default=0.00035, help="half-period in seconds")
+    parser.add_argument('--moves', type=int, default=3)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    waveform = step_engine.compile_move(18, 19, step_engine.LOW, args.delay, args.steps)
+    compile_ms = (time.perf_counter() - started) * 1e3
+    print(f"compile: {len(waveform)} edges in {compile_ms:.2f} ms, "
+          f"ideal duration {waveform.duration_us / 1e3:.1f} ms")
+
+    backend = step_engine.SimulatedBackend(realtime=True)
+    try:
+        for _ in range(args.moves):
+            handle = backend.submit(waveform)
+            handle.wait()
+            actual = handle.finished - handle.started
+            print(f"move: {handle.steps_done} steps in {actual * 1e3:.1f} ms "
+                  f"({handle.steps_done / actual:.0f} steps/s)")
+        mean, p99, worst = backend.jitter()
+        print(f"edge lateness: mean {mean:.1f} us, p99 {p99:.1f} us, max {worst:.1f} us")
+    finally:
+        backend.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+import struct
+
+# CRC-16/MODBUS: reflected polynomial 0xA001, initial value 0xFFFF.
+
+
+def _make_table():
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            if crc & 0x0001:
+                crc = (crc >> 1) ^ 0xA001
+            else:
+                crc >>= 1
+        table.append(crc)
+    return tuple(table)
+
+
+CRC_TABLE = _make_table()
+
+
+def calculate_crc(data, crc=0xFFFF):
+    # Works on bytes, bytearray and memoryview alike, without copying.
+    table = CRC_TABLE
+    for byte in data:
+        crc = (crc >> 8) ^ table[(crc ^ byte) & 0xFF]
+    return crc
+
+
+def check_crc(frame):
+    """Check the trailing little-endian CRC of a complete RTU frame in place."""
+    if len(frame) < 4:
+        return False
+    view = frame if isinstance(frame, memoryview) else memoryview(frame)
+    return calculate_crc(view[:-2]) == (view[-2] | (view[-1] << 8))
+
+
+_HEAD = struct.Struct('>BBHH')
+_HEAD_MULTIPLE = struct.Struct('>BBHHB')
+_CRC = struct.Struct('<H')
+
+MAX_FRAME = 256
+
+
+class FrameBuilder:
+    """Builds request frames (CRC included) into one preallocated buffer.
+
+    Each build returns a memoryview into the shared buffer, which is only
+    valid until the next build; callers that send from several threads must
+    hold their own lock around build + write.
+    """
+
+    def __init__(self, size=MAX_FRAME):
+        self._buffer = bytearray(size)
+        self._view = memoryview(self._buffer)
+
+    def _finish(self, length):
+        _CRC.pack_into(self._buffer, length, calculate_crc(self._view[:length]))
+        return self._view[:length + 2]
+
+    def read_registers(self, slave_address, register_address, count, function_code=0x03):
+        _HEAD.pack_into(self._buffer, 0, slave_address, function_code, register_address, count)
+        return self._finish(6)
+
+    def write_single_register(self, slave_address, register_address, value):
+        _HEAD.pack_into(self._buffer, 0, slave_address, 0x06, register_address, value)
+        return self._finish(6)
+
+    def write_multiple_registers(self, slave_address, register_address, values):
+        count = len(values)
+        if count < 1 or 7 + 2 * count + 2 > len(self._buffer):
+            raise ValueError(f"Cannot write {count} registers in one frame")
+        _HEAD_MULTIPLE.pack_into(self._buffer, 0, slave_address, 0x10, register_address, count, 2 * count)
+        struct.pack_into('>%dH' % count, self._buffer, 7, *values)
+        return self._finish(7 + 2 * count)
+
+    def raw(self, pdu):
+        # Arbitrary request without CRC, e.g. from the legacy send_request() API.
+        length = len(pdu)
+        self._buffer[:length] = pdu
+        return self._finish(length)
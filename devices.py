@@ -0,0 +1,341 @@
+"""Turntables driven by one service process, each with its own worker.
+
+The service builds its tables from DEVICES_FILE (json; TURNTABLE_DEVICES
+overrides the path), or a single stepper table on its own pin constants
+when there is no file:
+
+    {"devices": [
+        {"id": "left", "type": "stepper", "pul_pin": 18, "dir_pin": 19,
+         "enable_pin": 23, "hall_pin": 6},
+        {"id": "right", "type": "servo", "port": "/dev/ttyUSB0", "slave": 1}
+    ]}
+
+Stepper keys: pul_pin, dir_pin, hall_pin, enable_pin, capture_pin,
+capture_pulse (s), steps_per_revolution, start_speed, max_speed,
+acceleration, profile.
+Servo keys: port, baudrate, slave, speed (0.1 rpm), accel_ms,
+pulses_per_degree, motor_pulses_per_rev, timeout, sample (poll the encoder
+continuously for angle_at), sample_capacity, velocity_mode (the drive's
+pr_mode for constant speed, from its manual; spins and stopping a running
+move need it), status_address, status_in_position, status_fault (status
+word address and bit masks from the manual; without status_address moves
+end when the feedback settles). "type" picks the driver (see drivers),
+stepper when missing. The first table is the default for commands
+without a "device" and keeps the journal and home offset files of the
+single-table service; the others get files suffixed with their id.
+"""
+import json
+import os
+import threading
+
+import metrics
+import scan_plan
+import step_engine
+from drivers import DRIVER_TYPES, ServoDriver, StepperDriver
+from homing import HOME_OFFSET_FILE
+from motion_scheduler import MotionScheduler
+from position_journal import JOURNAL_FILE, PositionJournal, trusted_position
+
+DEVICES_FILE = os.environ.get('TURNTABLE_DEVICES') or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'turntables.json')
+
+
+def load_config(path=DEVICES_FILE):
+    """Device entries from path, or None when there is no such file.
+
+    Raises ValueError for a config the service cannot run.
+    """
+    try:
+        with open(path) as f:
+            config = json.load(f)
+    except FileNotFoundError:
+        return None
+    entries = config.get("devices") if isinstance(config, dict) else None
+    if not isinstance(entries, list) or not entries:
+        raise ValueError("%s: expected {\"devices\": [...]} with at least one device" % path)
+    seen = set()
+    for entry in entries:
+        if not isinstance(entry, dict) or not isinstance(entry.get("id"), str):
+            raise ValueError("%s: every device needs a string \"id\"" % path)
+        if entry["id"] in seen:
+            raise ValueError("%s: duplicate device id %r" % (path, entry["id"]))
+        seen.add(entry["id"])
+        if entry.get("type", "stepper") not in DRIVER_TYPES:
+            raise ValueError("%s: unknown device type %r" % (path, entry.get("type")))
+    return entries
+
+
+def device_file(path, device_id):
+    # position_journal.bin -> position_journal.<id>.bin
+    root, ext = os.path.splitext(path)
+    return "%s.%s%s" % (root, device_id, ext)
+
+
+class Turntable:
+    """One table: a driver (see drivers), its position journal and a motion worker of its own.
+
+    Jobs run on the worker: "turn" moves by angle degrees, "move_to" to an
+    absolute angle, "scan" plays a scan plan and "spin" turns continuously
+    until stop_spin(). abort() interrupts the running move.
+    """
+
+    def __init__(self, device_id, driver, journal_file=JOURNAL_FILE):
+        self.id = device_id
+        self.driver = driver
+        driver.name = device_id
+        self.journal_file = journal_file
+        self.journal = None
+        self.scheduler = None
+        self.publisher = None
+        self.active_scan = None
+        # Spin job in progress
+        self.spinning = None
+        # Called as on_result(event, job, message) after every job event is published
+        self.on_result = None
+
+    @property
+    def type(self):
+        return self.driver.type
+
+    @property
+    def steps_per_revolution(self):
+        return self.driver.steps_per_revolution
+
+    @property
+    def current_steps(self):
+        return self.driver.steps
+
+    @property
+    def current_angle(self):
+        return self.driver.angle
+
+    @property
+    def homed(self):
+        return self.driver.homed
+
+    def start(self, publisher, max_queue=16, coalesce=False):
+        """Start the worker; status goes out through publisher (a StatusPublisher)."""
+        self.publisher = publisher
+        self.scheduler = MotionScheduler(self.execute_job, self.on_job_event, abort=self.abort,
+                                         max_queue=max_queue, coalesce=coalesce)
+        self.driver.start()
+
+    @property
+    def busy(self):
+        return self.scheduler is not None and self.scheduler.busy
+
+    def publish(self, status, **fields):
+        # State repeated by heartbeats until the next transition
+        fields["device"] = self.id
+        self.publisher.publish(status, state="processing" if self.busy else "idle", **fields)
+
+    def _journal(self, steps=0):
+        # After every finished move (not every spin chunk or feedback read): one flush per move
+        if self.journal is not None:
+            self.journal.write(self.current_angle, self.current_steps, self.homed)
+
+    def set_home(self):
+        self.driver.set_home()
+        self._journal()
+
+    def restore_position(self):
+        # Warm restart: resume from a journal left by a clean shutdown, home after anything else
+        self.journal = PositionJournal(self.journal_file)
+        record = trusted_position(self.journal.last)
+        if record is not None:
+            self.driver.set_position(record.steps, True)
+            print("{}: resumed at angle {} from the position journal".format(self.id, self.current_angle))
+            self._journal()
+        else:
+            self.home()
+
+    def close(self):
+        # Finish or abort the running move first so the journal holds where the table really stopped
+        clean = True
+        if self.scheduler is not None:
+            self.scheduler.close(timeout=5)
+            clean = not self.scheduler.busy
+        self.driver.close()
+        if self.journal is not None:
+            self.journal.close(clean=clean and self.homed)
+
+    def turn(self, angle):
+        """Move by angle degrees; returns the signed steps made."""
+        return self.driver.move_relative(angle)
+
+    def move_to(self, angle):
+        """Shortest move to angle degrees from home; returns the signed steps made."""
+        return self.driver.move_absolute(angle)
+
+    def home(self):
+        found = self.driver.home()
+        if found:
+            self._journal()
+        return found
+
+    def position(self):
+        """Angle in degrees, read back from the drive where it has feedback."""
+        self.driver.position()
+        return self.current_angle
+
+    def abort(self):
+        if self.active_scan is not None:
+            self.active_scan.stop()
+        self.driver.stop()
+
+    def set_spin_speed(self, rpm):
+        """Change the speed of the running spin; False when the table is not spinning."""
+        if self.spinning is None:
+            return False
+        self.driver.set_spin_speed(rpm)
+        return True
+
+    def stop_spin(self):
+        """Ramp the running spin down to a stop; False when the table is not spinning."""
+        if self.spinning is None:
+            return False
+        self.driver.stop_spin()
+        return True
+
+    def angle_at(self, timestamps):
+        """Table angles at monotonic timestamps from encoder samples, or None without an encoder."""
+        return self.driver.angle_at(timestamps)
+
+    def run_scan(self, job):
+        # Every segment is planned before the table moves; stops then follow each other at
+        # mechanical speed with an "at_angle" event (and capture trigger) at each one
+        driver = self.driver
+        stage = metrics.start()
+        segments = scan_plan.plan_segments(job.plan, self.current_steps, self.steps_per_revolution,
+                                           driver.prepare)
+        metrics.observe('scan.plan', stage)
+
+        def on_stop(stop, arrived):
+            self.publish("at_angle", timestamp=arrived, job=job.id, seq=stop.seq, angle=self.current_angle,
+                         target=stop.angle, capture=stop.capture, stops=len(segments))
+
+        runner = scan_plan.ScanRunner(lambda segment: driver.move_steps(segment.steps, segment.waveform),
+                                      on_stop, on_moved=self._journal, capture=driver.capture,
+                                      tolerance=driver.scan_tolerance)
+        self.active_scan = runner
+        try:
+            if job.status == "cancelled":
+                return
+            runner.run(segments)
+        finally:
+            self.active_scan = None
+
+    def execute_job(self, job):
+        if metrics.ENABLED:
+            metrics.record('job.queue_wait', (job.started - job.submitted) * 1e6)
+        # A stop() from here on, even before the first pulse is queued, cancels the job's moves
+        self.driver.arm()
+        if job.status == "cancelled":
+            return
+        try:
+            if job.action == "scan":
+                self.run_scan(job)
+            elif job.action == "spin":
+                self.driver.begin_spin(job.speed)
+                if job.status == "cancelled":
+                    self.driver.stop()
+                self.spinning = job
+                try:
+                    self.driver.spin()
+                finally:
+                    self.spinning = None
+            elif job.action == "move_to":
+                self.move_to(job.angle)
+            else:
+                self.turn(job.angle)
+        finally:
+            self._journal()
+
+    def on_job_event(self, event, job):
+        message = {"job": job.id, "angle": job.angle}
+        if job.plan:
+            message["stops"] = len(job.plan)
+        if job.speed is not None:
+            message["rpm"] = job.speed
+        if job.merged:
+            message["merged"] = [merged.id for merged in job.merged]
+        if job.error:
+            message["reason"] = job.error
+        if event in ("completed", "error"):
+            # Where the table ended up: the drive's own feedback for a servo
+            try:
+                message["position"] = self.position()
+            except RuntimeError as e:
+                print("{}: no position after job {}: {}".format(self.id, job.id, e))
+                message["position"] = self.current_angle
+            message["steps"] = self.current_steps
+        if event in ("completed", "cancelled", "error"):
+            # Wall-clock times the job ran (started is None for a job cancelled in the queue)
+            message["started"] = job.started
+            message["ended"] = job.finished
+        self.publish(event, **message)
+        if self.on_result is not None:
+            self.on_result(event, job, message)
+        if event != "started" and not self.busy:
+            self.publish("idle")
+
+
+STEPPER_KEYS = ('pul_pin', 'dir_pin', 'hall_pin', 'enable_pin', 'capture_pin', 'capture_pulse',
+                'steps_per_revolution', 'start_speed', 'max_speed', 'acceleration', 'profile')
+SERVO_KEYS = ('port', 'baudrate', 'slave', 'speed', 'accel_ms', 'pulses_per_degree', 'motor_pulses_per_rev',
+              'timeout', 'sample', 'sample_capacity', 'velocity_mode', 'status_address',
+              'status_in_position', 'status_fault')
+
+
+def create_devices(entries, gpio):
+    """Turntables for the config entries; the first one is the default."""
+    steppers = sum(1 for entry in entries if entry.get("type", "stepper") == "stepper")
+    devices = []
+    for index, entry in enumerate(entries):
+        device_id = entry["id"]
+        journal_file = JOURNAL_FILE if index == 0 else device_file(JOURNAL_FILE, device_id)
+        if entry.get("type", "stepper") == "stepper":
+            options = {key: entry[key] for key in STEPPER_KEYS if key in entry}
+            if steppers > 1:
+                # pigpio has a single DMA wave generator, so parallel tables use threaded playback
+                options["backend_factory"] = step_engine.GPIOBackend
+            home_offset_file = HOME_OFFSET_FILE if index == 0 else device_file(HOME_OFFSET_FILE, device_id)
+            driver = StepperDriver(gpio, home_offset_file=home_offset_file, **options)
+        else:
+            options = {key: entry[key] for key in SERVO_KEYS if key in entry}
+            driver = ServoDriver(**options)
+        devices.append(Turntable(device_id, driver, journal_file=journal_file))
+    return DeviceRegistry(devices)
+
+
+class DeviceRegistry:
+    """Turntables by id, in config order."""
+
+    def __init__(self, devices):
+        self._devices = {device.id: device for device in devices}
+        self.default = devices[0]
+
+    def __iter__(self):
+        return iter(self._devices.values())
+
+    def __len__(self):
+        return len(self._devices)
+
+    def get(self, device_id=None):
+        """The device with device_id, the default one for None, else None."""
+        if device_id is None:
+            return self.default
+        return self._devices.get(device_id)
+
+    def restore_positions(self):
+        # Tables that need homing home in parallel
+        threads = [threading.Thread(target=device.restore_position, name="restore-%s" % device.id)
+                   for device in self]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def close(self):
+        for device in self:
+            device.close()
@@ -0,0 +1,469 @@
+"""Turntable drivers: the hardware side of a table behind one interface.
+
+Every driver offers move_relative(angle), move_absolute(angle), home(),
+position() and stop(), plus continuous spins and the hooks scans use.
+Positions are counted in steps since home (feedback pulses for the
+servo), steps_per_revolution to a turn; positive is the direction of a
+positive turn angle. devices.Turntable runs a driver behind its worker.
+"""
+import threading
+import time
+from collections import deque
+
+import metrics
+import motion_profile
+import step_engine
+from encoder_sampler import EncoderSampler
+from homing import HOME_OFFSET_FILE, Homing
+from modbus_rtu import get_session
+from motion_monitor import PULSES_PER_TABLE_DEGREE, MotionMonitor
+from register_map import get_planner, position_move_updates, velocity_updates
+
+
+class TurntableDriver:
+    """Common interface of the table drivers.
+
+    move_relative(), move_absolute() and move_steps() return the signed
+    steps actually made, which is less than asked when stop() interrupted
+    the move. A stop() also refuses every move started after it until
+    arm() is called for the next job, so a stop that lands while a move is
+    still being planned is not lost.
+    """
+
+    type = None
+    steps_per_revolution = 12800
+    # Whether stop() can interrupt a running move, and whether spins can run at all
+    can_interrupt = True
+    can_spin = True
+    # Steps a scan segment may fall short of its target and still count as reached
+    scan_tolerance = 0
+
+    def __init__(self):
+        self.name = self.type  # shown in messages; the device id once a Turntable holds the driver
+        self.steps = 0
+        self.homed = False
+        # Commanded table rpm (signed) of the running spin, and requests to end it
+        self.spin_rpm = 0.0
+        self._spin_changed = threading.Event()
+        self._spin_stopping = False
+        self._spin_aborted = False
+        self._stopped = threading.Event()
+
+    @property
+    def angle(self):
+        return (self.steps % self.steps_per_revolution) * 360 / self.steps_per_revolution
+
+    def _moved(self, steps):
+        self.steps += steps
+
+    def set_position(self, steps, homed=True):
+        """Take steps as the current position, e.g. from the position journal."""
+        self.steps = steps
+        self.homed = homed
+
+    def set_home(self):
+        self.set_position(0, True)
+
+    def position(self):
+        """Current position in steps."""
+        return self.steps
+
+    def move_relative(self, angle):
+        raise NotImplementedError
+
+    def move_absolute(self, angle):
+        """Shortest turn to angle (degrees from home)."""
+        target = int(round((angle % 360) * self.steps_per_revolution / 360))
+        delta = (target - self.steps) % self.steps_per_revolution
+        if delta > self.steps_per_revolution // 2:
+            delta -= self.steps_per_revolution
+        return self.move_steps(delta)
+
+    def prepare(self, steps):
+        """Whatever move_steps() can reuse for steps, computed ahead (scans plan with it)."""
+        return None
+
+    def move_steps(self, steps, prepared=None):
+        raise NotImplementedError
+
+    def home(self):
+        """Establish position 0; False when home was not found."""
+        raise NotImplementedError
+
+    def arm(self):
+        # Accept moves again after a stop(); called before each job
+        self._stopped.clear()
+
+    def stop(self):
+        """Interrupt the running move or spin."""
+        self._stopped.set()
+        self._spin_aborted = self._spin_stopping = True
+        self._spin_changed.set()
+
+    def begin_spin(self, rpm):
+        # Arms a spin before it runs, so a stop() from now on ends it
+        self.spin_rpm = rpm
+        self._spin_stopping = self._spin_aborted = False
+        self._spin_changed.clear()
+
+    def spin(self):
+        """Turn at spin_rpm until stop_spin() or stop(); call begin_spin() first."""
+        raise NotImplementedError
+
+    def set_spin_speed(self, rpm):
+        self.spin_rpm = rpm
+        self._spin_changed.set()
+
+    def stop_spin(self):
+        self._spin_stopping = True
+        self._spin_changed.set()
+
+    def capture(self, stop):
+        pass
+
+    def angle_at(self, timestamps):
+        """Table angles at monotonic timestamps from encoder samples, or None without an encoder."""
+        return None
+
+    def start(self):
+        """Background work of the driver, started with the service."""
+
+    def close(self):
+        pass
+
+
+class StepperDriver(TurntableDriver):
+    """Stepper on step/dir GPIO pins with a Hall sensor at home.
+
+    Moves are compiled to waveforms and played by a step_engine backend;
+    the position is the count of steps made.
+    """
+
+    type = "stepper"
+    # Seconds of pulses generated ahead while spinning; a speed change takes effect within two
+    SPIN_CHUNK = 0.1
+
+    def __init__(self, gpio, pul_pin, dir_pin, hall_pin=None, enable_pin=None, capture_pin=None,
+                 steps_per_revolution=12800, start_speed=1 / (2 * 0.00035), max_speed=4800,
+                 acceleration=16000, profile='trapezoid', capture_pulse=0.001, backend_factory=None,
+                 home_offset_file=HOME_OFFSET_FILE):
+        super().__init__()
+        self.gpio = gpio
+        self.pul_pin = pul_pin
+        self.dir_pin = dir_pin
+        self.hall_pin = hall_pin
+        self.enable_pin = enable_pin
+        self.capture_pin = capture_pin
+        self.capture_pulse = capture_pulse
+        self.steps_per_revolution = steps_per_revolution
+        self.start_speed = start_speed
+        self.max_speed = max_speed
+        self.acceleration = acceleration
+        self.profile = profile
+        self.home_offset_file = home_offset_file
+        self._backend_factory = backend_factory or step_engine.default_backend
+        self._backend = None
+        # Orders submits against stop(): a move is either queued before the backend is stopped or refused
+        self._stop_lock = threading.Lock()
+
+        gpio.setup(pul_pin, gpio.OUT)
+        gpio.setup(dir_pin, gpio.OUT)
+        if enable_pin is not None:
+            gpio.setup(enable_pin, gpio.OUT)
+            gpio.output(enable_pin, gpio.LOW)
+        if capture_pin is not None:
+            gpio.setup(capture_pin, gpio.OUT)
+            gpio.output(capture_pin, gpio.LOW)
+
+        # Off the Pi the table itself is simulated: step pulses move it and it drives the Hall input
+        self.simulated = None
+        if getattr(gpio, 'SIMULATED', False):
+            from sim_devices import SimulatedStepper
+            self.simulated = SimulatedStepper(gpio, pul_pin, dir_pin, hall_pin, steps_per_revolution,
+                                              magnet_step=steps_per_revolution // 2)
+
+    @property
+    def backend(self):
+        # Created on first use so the choice (pigpio DMA or threaded GPIO) happens after pin setup.
+        if self._backend is None:
+            self._backend = self._backend_factory(self.gpio)
+        return self._backend
+
+    def close(self):
+        if self._backend is not None:
+            self._backend.close()
+
+    def home(self):
+        # Interrupt-driven: fast approach to the Hall edge, slow re-approach, then the cached
+        # magnet offset (measured on the first homing) in place of the old fixed 15-step correction
+        if self.hall_pin is None:
+            print("{}: cannot home without a hall_pin in the device config".format(self.name))
+            return False
+        result = Homing(self.gpio, self.backend, self.pul_pin, self.dir_pin, self.hall_pin,
+                        self.steps_per_revolution, fast_speed=2 * self.start_speed, start_speed=self.start_speed,
+                        acceleration=self.acceleration, offset_file=self.home_offset_file).home()
+        if result.found:
+            print("{}: magnetic field detected! Homed in {:.2f} s ({} steps)".format(
+                self.name, result.elapsed, result.steps_moved))
+            self.set_home()
+        else:
+            print("{}: home sensor not found after {} steps".format(self.name, result.steps_moved))
+        return result.found
+
+    def stop(self):
+        with self._stop_lock:
+            super().stop()
+        self.backend.stop()
+
+    def _submit(self, waveform):
+        # The move's handle, or None when stop() was called since the last arm()
+        with self._stop_lock:
+            if self._stopped.is_set():
+                return None
+            return self.backend.submit(waveform)
+
+    def _delays(self, steps):
+        # Ramp from the start speed up to max_speed and back (cached per step count)
+        return motion_profile.step_delays(steps, self.max_speed, self.acceleration, self.start_speed, self.profile)
+
+    def prepare(self, steps):
+        # Waveform for a signed step count; DIR LOW is a positive angle
+        direction = self.gpio.LOW if steps > 0 else self.gpio.HIGH
+        return step_engine.compile_move(self.pul_pin, self.dir_pin, direction, self._delays(abs(steps)),
+                                        first_level=self.gpio.HIGH)
+
+    def move_steps(self, steps, prepared=None):
+        if not steps:
+            return 0
+        if prepared is None:
+            stage = metrics.start()
+            prepared = self.prepare(steps)
+            metrics.observe('rotate.compile', stage)
+        stage = metrics.start()
+        move = self._submit(prepared)
+        if move is None:
+            return 0
+        move.wait()
+        metrics.observe('rotate.move', stage)
+        moved = move.steps_done if steps > 0 else -move.steps_done
+        self._moved(moved)
+        return moved
+
+    def capture(self, stop):
+        if stop.capture and self.capture_pin is not None:
+            self.gpio.output(self.capture_pin, self.gpio.HIGH)
+            time.sleep(self.capture_pulse)
+            self.gpio.output(self.capture_pin, self.gpio.LOW)
+
+    def move_relative(self, Angle):
+        steps = int(abs(Angle) * (self.steps_per_revolution / 360))
+        return self.move_steps(steps if Angle > 0 else -steps)
+
+    def spin(self):
+        # A continuous pulse stream: short waveforms queued back to back on the backend, ramps
+        # between speeds, starting and stopping at start_speed like a move does.
+        low = self.start_speed
+        direction = 0
+        speed = 0.0
+        pending = deque()
+        try:
+            while not self._spin_aborted:
+                self._spin_changed.clear()
+                rpm = 0.0 if self._spin_stopping else self.spin_rpm
+                target = min(abs(rpm) * self.steps_per_revolution / 60.0, self.max_speed)
+                sign = 1 if rpm > 0 else -1
+                delays = None
+                if speed == 0:
+                    if target == 0:
+                        break
+                    direction, speed = sign, min(target, low)
+                elif target == 0 or sign != direction:
+                    # Slow down to the start speed, then stop (or reverse)
+                    if speed <= low:
+                        speed = 0
+                        continue
+                    delays, speed = motion_profile.ramp_delays(speed, low, self.acceleration), low
+                elif target != speed:
+                    delays = motion_profile.ramp_delays(max(speed, low), max(target, low), self.acceleration)
+                    speed = target
+                if delays is None or not len(delays):
+                    delays = motion_profile.cruise_delays(max(int(speed * self.SPIN_CHUNK), 1), speed)
+                level = self.gpio.LOW if direction > 0 else self.gpio.HIGH
+                waveform = step_engine.compile_move(self.pul_pin, self.dir_pin, level, delays,
+                                                    first_level=self.gpio.HIGH)
+                move = self._submit(waveform)
+                if move is None:
+                    break
+                pending.append((move, direction))
+                # One chunk playing and one queued behind it
+                while len(pending) > 1:
+                    move, sign = pending.popleft()
+                    move.wait()
+                    self._moved(sign * move.steps_done)
+        finally:
+            while pending:
+                move, sign = pending.popleft()
+                move.wait()
+                self._moved(sign * move.steps_done)
+
+
+class ServoDriver(TurntableDriver):
+    """Servo on a Modbus RTU drive in point-to-point (PR) mode, with position feedback.
+
+    Steps are feedback pulses, counted from origin (the feedback at home).
+    There is no home sensor: home() takes the current position as 0
+    degrees. Spins run in the drive's velocity mode, and stop() interrupts
+    a move by switching to it at speed 0, which ramps the table down at
+    accel_ms wherever it is. Its pr_mode value differs between drives and
+    has no default: without velocity_mode the table cannot spin, and a
+    stop() only keeps further moves from starting. Moves end when the
+    feedback settles, or sooner on the in-position bit of the drive's
+    status word if status_address is configured. With sample=True an
+    EncoderSampler polls the feedback continuously so angle_at() can
+    place camera frames.
+    """
+
+    type = "servo"
+    # Feedback poll interval while spinning
+    SPIN_POLL = 0.2
+
+    def __init__(self, port, baudrate=9600, slave=1, speed=10000, accel_ms=3000,
+                 pulses_per_degree=PULSES_PER_TABLE_DEGREE, motor_pulses_per_rev=100000, timeout=30,
+                 sample=False, sample_capacity=65536, velocity_mode=None, status_address=None,
+                 status_in_position=0, status_fault=0):
+        super().__init__()
+        self.port = port
+        self.velocity_mode = velocity_mode
+        self.baudrate = baudrate
+        self.slave = slave
+        self.speed = speed
+        self.accel_ms = accel_ms
+        self.pulses_per_degree = pulses_per_degree
+        self.motor_pulses_per_rev = motor_pulses_per_rev
+        self.timeout = timeout
+        self.steps_per_revolution = int(round(360 * pulses_per_degree))
+        self.planner = get_planner(port, baudrate, slave)
+        self.monitor = MotionMonitor(get_session(port, baudrate), slave, pulses_per_degree=pulses_per_degree,
+                                     status_address=status_address, in_position_bit=status_in_position,
+                                     fault_bit=status_fault)
+        self.scan_tolerance = self.monitor.tolerance_pulses
+        self.origin = None  # feedback pulses at home
+        self.sampler = None
+        if sample:
+            self.sampler = EncoderSampler(get_session(port, baudrate), slave, sample_capacity,
+                                          pulses_per_degree=pulses_per_degree)
+
+    @property
+    def can_interrupt(self):
+        return self.velocity_mode is not None
+
+    can_spin = can_interrupt
+
+    def start(self):
+        if self.sampler is not None:
+            self.sampler.start()
+
+    def close(self):
+        if self.sampler is not None:
+            self.sampler.stop()
+
+    def _read_feedback(self):
+        feedback = self.monitor.read_feedback()
+        if feedback is None:
+            raise RuntimeError("no position feedback from slave %d on %s" % (self.slave, self.port))
+        if self.origin is None:
+            self.origin = feedback - self.steps
+        # Whatever the table did since the last look (e.g. turned by hand) counts too
+        self._moved(feedback - self.origin - self.steps)
+        if self.sampler is not None:
+            self.sampler.origin = self.origin
+        return feedback
+
+    def set_position(self, steps, homed=True):
+        super().set_position(steps, homed)
+        feedback = self.monitor.read_feedback()
+        self.origin = None if feedback is None else feedback - steps
+
+    def home(self):
+        self.set_home()
+        self._read_feedback()
+        return True
+
+    def position(self):
+        # Real feedback; the tracked steps follow it
+        self._read_feedback()
+        return self.steps
+
+    def angle_at(self, timestamps):
+        if self.sampler is None:
+            return None
+        return self.sampler.angle_at(timestamps)
+
+    def move_steps(self, steps, prepared=None):
+        if self._stopped.is_set():
+            return 0
+        start = self._read_feedback()
+        sent = self.planner.write(position_move_updates(steps, self.speed, self.accel_ms))
+        if not sent or not all(ok for _, _, ok in sent):
+            self.planner.invalidate()
+            raise RuntimeError("move command to slave %d on %s failed" % (self.slave, self.port))
+        result = self.monitor.wait(start + steps, start, self.timeout,
+                                   stop=self._stopped if self.can_interrupt else None)
+        if result.reason == 'stopped':
+            # Speed 0 in velocity mode ends the move where it is, ramped down at accel_ms
+            try:
+                self._speed_command(0)
+            except RuntimeError:
+                self.planner.invalidate()
+                raise
+            result = self.monitor.wait(None, start, self.timeout, moving=True)
+        if not result.reached or self._stopped.is_set():
+            # Whatever the drive holds now, the next move writes every register again
+            self.planner.invalidate()
+        moved = result.pulses - start if result.pulses is not None else 0
+        self._moved(moved)
+        if not result.reached:
+            raise RuntimeError("move ended: %s" % result.reason)
+        return moved
+
+    def move_relative(self, angle):
+        return self.move_steps(int(round(angle * self.pulses_per_degree)))
+
+    def _speed_command(self, rpm):
+        # Table rpm -> speed_rpm register (motor rpm in 0.1 rpm units, signed)
+        if self.velocity_mode is None:
+            raise RuntimeError("servo on slave %d has no velocity_mode configured" % self.slave)
+        gear = 360 * self.pulses_per_degree / self.motor_pulses_per_rev
+        sent = self.planner.write(velocity_updates(int(round(rpm * gear * 10)), self.accel_ms, self.velocity_mode))
+        if not sent or not all(ok for _, _, ok in sent):
+            raise RuntimeError("speed command to slave %d on %s failed" % (self.slave, self.port))
+
+    def spin(self):
+        if self._stopped.is_set():
+            return
+        last = self._read_feedback()
+        rpm = self.spin_rpm
+        self._speed_command(rpm)
+        try:
+            while not self._spin_stopping:
+                if self._spin_changed.wait(self.SPIN_POLL):
+                    self._spin_changed.clear()
+                    if not self._spin_stopping and self.spin_rpm != rpm:
+                        rpm = self.spin_rpm
+                        self._speed_command(rpm)
+                sample = self.monitor.read_feedback()
+                if sample is not None:
+                    self._moved(sample - last)
+                    last = sample
+        finally:
+            self._speed_command(0)
+            if rpm:
+                result = self.monitor.wait(None, last, self.timeout)
+                if result.pulses is not None:
+                    self._moved(result.pulses - last)
+
+
+DRIVER_TYPES = {
+    'stepper': StepperDriver,
+    'servo': ServoDriver,
+}
@@ -0,0 +1,135 @@
+import threading
+import time
+
+import numpy as np
+
+from motion_monitor import PULSES_PER_TABLE_DEGREE
+from register_map import SERVO_REGISTERS
+
+
+class SampleRing:
+    """Fixed-size ring of (monotonic timestamp, pulses) samples in numpy arrays.
+
+    Memory stays at capacity samples however long the session; the oldest
+    samples are overwritten.
+    """
+
+    def __init__(self, capacity=65536):
+        self.capacity = capacity
+        self.times = np.zeros(capacity, dtype=np.float64)
+        self.pulses = np.zeros(capacity, dtype=np.int64)
+        self._next = 0
+        self.count = 0
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def append(self, timestamp, pulses):
+        self.times[self._next] = timestamp
+        self.pulses[self._next] = pulses
+        self._next = (self._next + 1) % self.capacity
+        self.count += 1
+
+    def ordered(self):
+        """(times, pulses), oldest first; views when the ring has not wrapped yet."""
+        if self.count <= self.capacity:
+            return self.times[:self.count], self.pulses[:self.count]
+        return (np.concatenate((self.times[self._next:], self.times[:self._next])),
+                np.concatenate((self.pulses[self._next:], self.pulses[:self._next])))
+
+
+class EncoderSampler:
+    """Polls the 32-bit position feedback of a servo drive from a background thread.
+
+    Samples are taken back to back (or every interval seconds), each
+    stamped with the midpoint of its Modbus transaction, and kept in a
+    SampleRing. The drive's counter wraps at 32 bits; samples are unwrapped
+    so long spins keep counting. angle_at() interpolates the table angle
+    for one timestamp or an array of them.
+    """
+
+    def __init__(self, session, slave_address, capacity=65536, interval=0.0, register_map=SERVO_REGISTERS,
+                 pulses_per_degree=PULSES_PER_TABLE_DEGREE):
+        self.session = session
+        self.slave_address = slave_address
+        self.interval = interval
+        self.register_map = register_map
+        self.pulses_per_degree = pulses_per_degree
+        self.origin = 0  # pulses at angle 0
+        self.ring = SampleRing(capacity)
+        self.errors = 0
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._raw = None
+        self._wraps = 0
+
+    def start(self):
+        if self._thread is None:
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name="encoder-sampler", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _unwrap(self, raw):
+        # raw is the signed 32-bit feedback; count wraps between consecutive samples
+        if self._raw is not None:
+            delta = raw - self._raw
+            if delta > 1 << 31:
+                self._wraps -= 1
+            elif delta < -(1 << 31):
+                self._wraps += 1
+        self._raw = raw
+        return raw + (self._wraps << 32)
+
+    def sample(self):
+        """Take one sample now; returns the unwrapped pulses or None."""
+        register = self.register_map['position_feedback']
+        sent = time.monotonic()
+        words = self.session.read_multiple_registers(self.slave_address, register.address, register.width)
+        received = time.monotonic()
+        if words is None:
+            self.errors += 1
+            return None
+        pulses = self._unwrap(self.register_map.decode('position_feedback', words, signed=True))
+        with self._lock:
+            self.ring.append((sent + received) / 2, pulses)
+        return pulses
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self.sample()
+            if self.interval:
+                self._stopped.wait(self.interval)
+
+    def latest(self):
+        """(timestamp, pulses) of the newest sample, or None."""
+        with self._lock:
+            if not self.ring.count:
+                return None
+            index = (self.ring._next - 1) % self.ring.capacity
+            return float(self.ring.times[index]), int(self.ring.pulses[index])
+
+    def pulses_at(self, timestamps):
+        """Interpolated pulses at monotonic timestamps; NaN outside the buffered window."""
+        scalar = np.ndim(timestamps) == 0
+        timestamps = np.atleast_1d(np.asarray(timestamps, dtype=np.float64))
+        with self._lock:
+            times, pulses = self.ring.ordered()
+            if len(times) < 2:
+                result = np.full(timestamps.shape, np.nan)
+            else:
+                result = np.interp(timestamps, times, pulses, left=np.nan, right=np.nan)
+        return float(result[0]) if scalar else result
+
+    def angle_at(self, timestamps, wrap=True):
+        """Table angle (degrees, 0-360 with wrap) at monotonic timestamps; NaN outside the window."""
+        angles = (np.asarray(self.pulses_at(timestamps)) - self.origin) / self.pulses_per_degree
+        if wrap:
+            angles = np.mod(angles, 360.0)
+        return float(angles) if np.ndim(angles) == 0 else angles
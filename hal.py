@@ -0,0 +1,25 @@
+"""Hardware backend selection.
+
+TURNTABLE_GPIO=rpi|sim picks the GPIO module: RPi.GPIO ("rpi", the
+default) or sim_devices.SimulatedGPIO. The simulation is only used when
+asked for, so a Pi with a broken RPi.GPIO install fails at startup
+instead of quietly stepping a virtual table. Serial ports named
+"sim://<bus>[?slaves=1,2]" open simulated Modbus drives instead of a
+real port (see modbus_rtu.open_serial_port).
+"""
+import os
+
+GPIO_BACKEND = os.environ.get('TURNTABLE_GPIO', 'rpi')
+
+
+def load_gpio(backend=GPIO_BACKEND):
+    if backend == 'rpi':
+        import RPi.GPIO as gpio
+        return gpio
+    if backend != 'sim':
+        raise ValueError(f"Unknown GPIO backend {backend!r}")
+    from sim_devices import SimulatedGPIO
+    return SimulatedGPIO()
+
+
+GPIO = load_gpio()
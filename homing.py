@@ -0,0 +1,162 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+
+import motion_profile
+import step_engine
+
+logger = logging.getLogger(__name__)
+
+HOME_OFFSET_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'home_offset.json')
+
+# offset_steps: steps from the magnet's leading edge to home; measured: offset measured this time
+HomingResult = namedtuple('HomingResult', 'found offset_steps steps_moved elapsed measured')
+
+
+def load_offset(path=HOME_OFFSET_FILE):
+    try:
+        with open(path) as f:
+            return json.load(f)["offset_steps"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def save_offset(offset_steps, width_steps, path=HOME_OFFSET_FILE):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump({"offset_steps": offset_steps, "magnet_width_steps": width_steps}, f)
+    os.replace(tmp, path)
+
+
+class Homing:
+    """Edge-triggered two-phase homing on the Hall sensor.
+
+    1. Fast approach in the homing direction, stopped by the sensor's
+       rising edge interrupt (at most one revolution).
+    2. Back off past the edge (however far the stop overshot it, taken
+       from the move's schedule, plus back_off_steps), then re-approach
+       slowly and stop on the edge again, which gives the edge position to
+       within a step.
+    3. Move on by the home offset: half the magnet width, measured once by
+       crossing the magnet slowly and cached in HOME_OFFSET_FILE, so later
+       homings skip the measurement.
+    """
+
+    def __init__(self, gpio, backend, pul_pin, dir_pin, sensor_pin, steps_per_rev=12800,
+                 direction=None, fast_speed=2800, start_speed=1428, acceleration=16000,
+                 slow_delay=0.0005, back_off_steps=200, offset_file=HOME_OFFSET_FILE):
+        self.gpio = gpio
+        self.backend = backend
+        self.pul_pin = pul_pin
+        self.dir_pin = dir_pin
+        self.sensor_pin = sensor_pin
+        self.steps_per_rev = steps_per_rev
+        # home() has always turned counterclockwise (DIR HIGH) to find the magnet
+        self.direction = gpio.HIGH if direction is None else direction
+        self.fast_speed = fast_speed
+        self.start_speed = start_speed
+        self.acceleration = acceleration
+        self.slow_delay = slow_delay
+        self.back_off_steps = back_off_steps
+        self.offset_file = offset_file
+        gpio.setup(sensor_pin, gpio.IN)
+
+    @property
+    def reverse(self):
+        return self.gpio.LOW if self.direction == self.gpio.HIGH else self.gpio.HIGH
+
+    def sensor_active(self):
+        return self.gpio.input(self.sensor_pin) == self.gpio.HIGH
+
+    def _move(self, direction, delays, stop_edge=None):
+        """Run one move; with stop_edge, abort it on that sensor edge.
+
+        Returns (edge seen, steps moved, steps moved after the edge).
+        """
+        # Pulses go HIGH then LOW like every other move, so the pin idles LOW afterwards and the
+        # next move's first rising edge is not lost
+        waveform = step_engine.compile_move(self.pul_pin, self.dir_pin, direction, delays, first_level=self.gpio.HIGH)
+        if stop_edge is None:
+            handle = self.backend.submit(waveform)
+            handle.wait()
+            return False, handle.steps_done, 0
+
+        hit = threading.Event()
+        handles = []
+        edge_time = []
+
+        def on_edge(channel):
+            edge_time.append(time.monotonic())
+            hit.set()
+            for handle in handles:
+                handle.cancel()
+
+        self.gpio.add_event_detect(self.sensor_pin, stop_edge, callback=on_edge)
+        try:
+            handle = self.backend.submit(waveform)
+            handles.append(handle)
+            if hit.is_set():
+                handle.cancel()
+            handle.wait()
+        finally:
+            self.gpio.remove_event_detect(self.sensor_pin)
+        if not edge_time:
+            return False, handle.steps_done, 0
+        # The stop lags the edge; the schedule says how far the table went past it
+        overshoot = max(handle.steps_done - handle.steps_at(edge_time[0]), 0)
+        return True, handle.steps_done, overshoot
+
+    def _fast(self, steps):
+        return motion_profile.step_delays(steps, self.fast_speed, self.acceleration, self.start_speed)
+
+    def home(self):
+        started = time.monotonic()
+        moved = 0
+        gpio = self.gpio
+
+        # Sitting on the magnet: leave it backwards first so the approach sees a clean rising edge.
+        if self.sensor_active():
+            _, steps, _ = self._move(self.reverse, [self.slow_delay] * (self.steps_per_rev // 4), gpio.FALLING)
+            moved += steps
+            _, steps, _ = self._move(self.reverse, [self.slow_delay] * self.back_off_steps)
+            moved += steps
+
+        # Phase 1: fast approach, at most one revolution plus the back-off distance
+        found, steps, overshoot = self._move(self.direction, self._fast(self.steps_per_rev + self.back_off_steps),
+                                             gpio.RISING)
+        moved += steps
+        if not found:
+            return HomingResult(False, None, moved, time.monotonic() - started, False)
+
+        # Phase 2: back off past the edge by the overshoot plus back_off_steps, and creep back onto it
+        _, steps, _ = self._move(self.reverse, self._fast(overshoot + self.back_off_steps))
+        moved += steps
+        found, steps, overshoot = self._move(self.direction, [self.slow_delay] * (2 * self.back_off_steps),
+                                             gpio.RISING)
+        moved += steps
+        if not found:
+            return HomingResult(False, None, moved, time.monotonic() - started, False)
+        if overshoot:
+            # Return to the edge itself
+            _, steps, _ = self._move(self.reverse, [self.slow_delay] * overshoot)
+            moved += steps
+
+        offset = load_offset(self.offset_file)
+        measured = offset is None
+        if measured:
+            # Cross the magnet once to measure it; home is its centre.
+            _, crossed, overshoot = self._move(self.direction, [self.slow_delay] * (self.steps_per_rev // 4),
+                                               gpio.FALLING)
+            moved += crossed
+            width = crossed - overshoot
+            offset = width // 2
+            save_offset(offset, width, self.offset_file)
+            logger.info("Measured magnet width %d steps, home offset %d steps", width, offset)
+            _, steps, _ = self._move(self.reverse, [self.slow_delay] * (crossed - offset))
+        else:
+            _, steps, _ = self._move(self.direction, [self.slow_delay] * offset)
+        moved += steps
+        return HomingResult(True, offset, moved, time.monotonic() - started, measured)
@@ -0,0 +1,147 @@
+import os
+import threading
+import time
+
+# Off unless TURNTABLE_STATS is set; when off start() returns None and nothing is recorded.
+ENABLED = os.environ.get('TURNTABLE_STATS', '') not in ('', '0')
+
+SUB_BUCKET_BITS = 5
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+MAX_EXPONENT = 40  # ~12 days in microseconds; larger values land in the last bucket
+
+
+def enable(on=True):
+    global ENABLED
+    ENABLED = on
+
+
+class Histogram:
+    """Log-linear histogram of microsecond durations, in the style of HdrHistogram.
+
+    Each power of two is split into SUB_BUCKETS linear buckets, so a
+    reported percentile is within 1/SUB_BUCKETS (about 3%) of the recorded
+    value while the table stays a fixed size.
+    """
+
+    def __init__(self):
+        self.counts = [0] * ((MAX_EXPONENT + 1) * SUB_BUCKETS)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    @staticmethod
+    def _index(value):
+        if value < SUB_BUCKETS:
+            return value
+        shift = min(value.bit_length() - SUB_BUCKET_BITS - 1, MAX_EXPONENT - 1)
+        return min((shift + 1) * SUB_BUCKETS + (value >> shift) - SUB_BUCKETS, (MAX_EXPONENT + 1) * SUB_BUCKETS - 1)
+
+    @staticmethod
+    def _highest(index):
+        # Largest value that falls in bucket index
+        if index < SUB_BUCKETS:
+            return index
+        shift = index // SUB_BUCKETS - 1
+        return ((index % SUB_BUCKETS + SUB_BUCKETS + 1) << shift) - 1
+
+    def record(self, value):
+        value = max(int(value), 0)
+        self.counts[self._index(value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, p):
+        if not self.count:
+            return 0
+        rank = max(int(self.count * p / 100.0 + 0.5), 1)
+        seen = 0
+        for index, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return min(self._highest(index), self.max)
+        return self.max
+
+    def summary(self):
+        return {"count": self.count, "p50": self.percentile(50), "p99": self.percentile(99),
+                "max": self.max, "mean": self.total / self.count if self.count else 0}
+
+
+_lock = threading.Lock()
+_histograms = {}
+_counters = {}
+
+
+def start():
+    """Timestamp for observe(), or None while disabled."""
+    return time.perf_counter_ns() if ENABLED else None
+
+
+def observe(name, started):
+    """Record the time since start() under name, in microseconds."""
+    if started is None:
+        return
+    elapsed = (time.perf_counter_ns() - started) // 1000
+    with _lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = Histogram()
+        histogram.record(elapsed)
+
+
+def record(name, value_us):
+    if not ENABLED:
+        return
+    with _lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = Histogram()
+        histogram.record(value_us)
+
+
+def count(name, n=1):
+    if not ENABLED:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + n
+
+
+def snapshot(reset=False):
+    """Percentiles (microseconds) of every stage and the counters; reset starts a new interval."""
+    global _histograms
+    with _lock:
+        histograms = _histograms
+        counters = dict(_counters)
+        if reset:
+            _histograms = {}
+    return {"histograms": {name: histogram.summary() for name, histogram in histograms.items()},
+            "counters": counters}
+
+
+class Reporter:
+    """Calls send(snapshot) every interval seconds from a daemon thread.
+
+    Histograms cover the last interval; counters are totals since start.
+    """
+
+    def __init__(self, send, interval=10.0):
+        self.send = send
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stats-reporter", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def close(self):
+        self._stopped.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.send(snapshot(reset=True))
+            except Exception as e:
+                print("Stats report failed: {}".format(e))
@@ -0,0 +1,237 @@
+import asyncio
+import itertools
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+from crc16 import FrameBuilder, calculate_crc, check_crc
+from modbus_rtu import open_serial_port, send_frame, silent_interval
+from register_map import (SERVO_REGISTERS, angle_to_pulses, forget_volatile, plan_writes, position_move_updates,
+                          update_shadow, velocity_updates)
+
+# Lower value goes on the bus first.
+PRIORITY_MOTION = 0
+PRIORITY_CONFIG = 5
+PRIORITY_TELEMETRY = 10
+
+
+class SerialTransport:
+    """RS-485 port driven from a dedicated thread so the event loop never blocks."""
+
+    def __init__(self, port, baudrate=9600, timeout=1.0):
+        self.port = port
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self._ser = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"rtu-{port}")
+
+    def _exchange(self, frame, response_length):
+        if self._ser is None or not self._ser.is_open:
+            self._ser = open_serial_port(self.port, self.baudrate, self.timeout)
+        try:
+            return send_frame(self._ser, frame, response_length, silent_interval(self.baudrate), self.timeout)
+        except (OSError, ValueError):
+            self._ser.close()
+            self._ser = None
+            raise
+
+    async def exchange(self, frame, response_length):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._exchange, frame, response_length)
+
+    async def close(self):
+        if self._ser is not None:
+            self._ser.close()
+            self._ser = None
+        self._executor.shutdown(wait=False)
+
+
+class LoopbackTransport:
+    """Test double that answers 0x03/0x06/0x10 from an in-memory register bank.
+
+    registers maps slave address -> {register address: word}; slaves that are
+    not in the bank do not answer. Replies are delayed by their wire time at
+    the given baud rate plus a fixed slave processing latency.
+    """
+
+    def __init__(self, registers=None, baudrate=9600, latency=0.001):
+        self.registers = registers if registers is not None else {}
+        self.baudrate = baudrate
+        self.latency = latency
+        self.frames = []
+
+    def _reply(self, request):
+        slave, function_code = request[0], request[1]
+        bank = self.registers.get(slave)
+        if bank is None:
+            return b''
+        address, count = struct.unpack_from('>HH', request, 2)  # count is the value for 0x06
+        if function_code == 0x03:
+            pdu = struct.pack('>BBB', slave, 0x03, 2 * count) + b''.join(
+                struct.pack('>H', bank.get(address + i, 0)) for i in range(count))
+        elif function_code == 0x06:
+            bank[address] = count
+            pdu = bytes(request[:6])
+        elif function_code == 0x10:
+            for i, word in enumerate(struct.unpack_from('>%dH' % count, request, 7)):
+                bank[address + i] = word
+            pdu = bytes(request[:6])
+        else:
+            pdu = struct.pack('>BBB', slave, function_code | 0x80, 0x01)
+        return pdu + struct.pack('<H', calculate_crc(pdu))
+
+    async def exchange(self, frame, response_length):
+        frame = bytes(frame)
+        self.frames.append(frame)
+        reply = self._reply(frame) if check_crc(frame) else b''
+        char_time = 11 / self.baudrate
+        await asyncio.sleep((len(frame) + len(reply)) * char_time + self.latency)
+        return reply if reply else None
+
+    async def close(self):
+        pass
+
+
+class BusScheduler:
+    """Serializes transactions from many slaves on one RS-485 line.
+
+    Every coroutine that talks to the bus submits its frame here; a single
+    worker sends them one at a time, highest priority first (FIFO within a
+    priority), and keeps the line silent for the turnaround gap between
+    frames. While one drive waits for its reply the next queued request of
+    another drive is already lined up, so several drives progress
+    interleaved instead of each waiting for the full sequence of the one
+    before it.
+    """
+
+    def __init__(self, transport, baudrate=9600, turnaround=None):
+        self.transport = transport
+        self.turnaround = silent_interval(baudrate) if turnaround is None else turnaround
+        self._queue = asyncio.PriorityQueue()
+        self._sequence = itertools.count()
+        self._worker = None
+        self.transactions = 0
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    def start(self):
+        if self._worker is None:
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def close(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        await self.transport.close()
+
+    async def submit(self, frame, response_length, priority=PRIORITY_TELEMETRY):
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((priority, next(self._sequence), bytes(frame), response_length, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        last_frame_end = 0.0
+        while True:
+            _, _, frame, response_length, future = await self._queue.get()
+            if future.cancelled():
+                continue
+            gap = last_frame_end + self.turnaround - loop.time()
+            if gap > 0:
+                await asyncio.sleep(gap)
+            try:
+                response = await self.transport.exchange(frame, response_length)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():
+                    future.set_result(response)
+            last_frame_end = loop.time()
+            self.transactions += 1
+
+
+class AsyncModbusClient:
+    """Coroutine API for one slave; mirrors ModbusRtuSession and pymodbus1.rotate."""
+
+    def __init__(self, scheduler, slave_address, register_map=SERVO_REGISTERS):
+        self.scheduler = scheduler
+        self.slave_address = slave_address
+        self.register_map = register_map
+        self._builder = FrameBuilder()
+        self._shadow = {}
+
+    async def read_multiple_registers(self, register_address, count, priority=PRIORITY_TELEMETRY):
+        frame = bytes(self._builder.read_registers(self.slave_address, register_address, count))
+        response = await self.scheduler.submit(frame, 5 + 2 * count, priority)
+        if response is None:
+            return None
+        if response[1] & 0x80:
+            print(f"Modbus exception response from slave {self.slave_address}: {response[2]}")
+            return None
+        return struct.unpack_from('>%dH' % count, response, 3)
+
+    async def read_register(self, register_address, priority=PRIORITY_TELEMETRY):
+        values = await self.read_multiple_registers(register_address, 1, priority)
+        if values is None:
+            return None
+        return values[0]
+
+    async def _write(self, frame, expected, priority):
+        response = await self.scheduler.submit(frame, 8, priority)
+        if response is None:
+            return False
+        if response[1] & 0x80:
+            print(f"Modbus exception response from slave {self.slave_address}: {response[2]}")
+            return False
+        if struct.unpack_from('>BBHH', response) != expected:
+            print("Error: Response does not match the request")
+            return False
+        return True
+
+    async def write_single_register(self, register_address, value, priority=PRIORITY_CONFIG):
+        frame = bytes(self._builder.write_single_register(self.slave_address, register_address, value))
+        return await self._write(frame, (self.slave_address, 0x06, register_address, value), priority)
+
+    async def write_multiple_registers(self, register_address, values, priority=PRIORITY_CONFIG):
+        frame = bytes(self._builder.write_multiple_registers(self.slave_address, register_address, values))
+        return await self._write(frame, (self.slave_address, 0x10, register_address, len(values)), priority)
+
+    async def write_registers(self, updates, priority=PRIORITY_CONFIG):
+        # Same shadow-cached, merged write plan as register_map.RegisterPlanner.
+        ok = True
+        for address, words in plan_writes(self.register_map, updates, self._shadow):
+            if len(words) == 1:
+                ok = await self.write_single_register(address, words[0], priority)
+            else:
+                ok = await self.write_multiple_registers(address, words, priority)
+            update_shadow(self._shadow, address, words, ok)
+            if not ok:
+                break
+        forget_volatile(self.register_map, self._shadow)
+        return ok
+
+    async def rotate(self, angle, speed, accel_deccel):
+        return await self.write_registers(position_move_updates(angle_to_pulses(angle), speed, accel_deccel),
+                                          PRIORITY_MOTION)
+
+    async def spin(self, speed, accel_deccel, velocity_mode):
+        # Constant speed (signed, 0.1 rpm units) until the next spin; speed 0 ramps to a stop.
+        # velocity_mode is the drive's pr_mode for it, from its manual.
+        return await self.write_registers(velocity_updates(speed, accel_deccel, velocity_mode), PRIORITY_MOTION)
+
+    async def read_position(self, priority=PRIORITY_TELEMETRY):
+        register = self.register_map['position_feedback']
+        words = await self.read_multiple_registers(register.address, register.width, priority)
+        if words is None:
+            return None
+        return self.register_map.decode('position_feedback', words, signed=True)
@@ -0,0 +1,256 @@
+import logging
+import struct
+import threading
+import time
+
+import serial
+
+from crc16 import FrameBuilder, calculate_crc, check_crc
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def open_serial_port(port, baudrate, timeout=1):
+    if port.startswith('sim://'):
+        # Simulated drives, see sim_devices.open_serial()
+        import sim_devices
+        return sim_devices.open_serial(port, baudrate, timeout)
+    return serial.Serial(
+        port=port,
+        baudrate=baudrate,
+        bytesize=serial.EIGHTBITS,
+        parity=serial.PARITY_EVEN,
+        stopbits=serial.STOPBITS_ONE,
+        timeout=timeout,
+        rtscts=False,
+        dsrdtr=False
+    )
+
+
+def silent_interval(baudrate):
+    # t3.5: 3.5 characters of 11 bits (start, 8 data, parity, stop). Above
+    # 19200 baud the spec fixes it at 1.75 ms.
+    if baudrate > 19200:
+        return 0.00175
+    return 3.5 * 11 / baudrate
+
+
+def _set_timeouts(ser, timeout, inter_byte_timeout):
+    # Reconfiguring the port is a driver call on some platforms, so only touch it on change.
+    if ser.timeout != timeout:
+        ser.timeout = timeout
+    if ser.inter_byte_timeout != inter_byte_timeout:
+        ser.inter_byte_timeout = inter_byte_timeout
+
+
+def receive_frame(ser, response_length, t35, timeout=1.0):
+    """Read one RTU reply as its bytes arrive.
+
+    Blocks until the slave starts answering (or timeout), then reads the
+    rest of the frame. The frame ends at the expected length, which is
+    taken from the byte count of a 0x03/0x04 reply and is 5 bytes for an
+    exception reply (function code | 0x80), or at the first gap of t3.5.
+    The port keeps the same timeouts for every transaction (timeout for the
+    first byte, t3.5 between bytes), so the overall deadline is checked here.
+    """
+    _set_timeouts(ser, timeout, t35)
+    deadline = time.monotonic() + timeout
+    frame = bytearray(ser.read(1))
+    if not frame:
+        return bytes(frame)
+    frame += ser.read(2)
+    expected = response_length
+    if len(frame) >= 2 and frame[1] & 0x80:
+        expected = 5
+    elif len(frame) >= 3 and frame[1] in (0x03, 0x04):
+        expected = 5 + frame[2]
+    if len(frame) == 3 and expected > 3 and time.monotonic() < deadline:
+        frame += ser.read(expected - 3)
+    return bytes(frame)
+
+
+def send_frame(ser, frame, response_length, t35=None, timeout=1.0):
+    # frame already carries its CRC; it may be a memoryview into a FrameBuilder.
+    if t35 is None:
+        t35 = silent_interval(ser.baudrate)
+    if ser.in_waiting:
+        # Leftovers of a reply that arrived after we gave up on it.
+        ser.reset_input_buffer()
+    started = metrics.start()
+    ser.write(frame)
+    response = receive_frame(ser, response_length, t35, timeout)
+    metrics.observe('modbus.transaction', started)
+    if len(response) >= 5 and response[1] & 0x80:
+        if not check_crc(response):
+            metrics.count('modbus.crc_error')
+            print("Error: CRC check failed")
+            return None
+        metrics.count('modbus.exception')
+        return response
+    if len(response) < response_length:
+        metrics.count('modbus.timeout' if not response else 'modbus.incomplete')
+        print(f"Error: Incomplete response (expected {response_length} bytes, got {len(response)} bytes)")
+        return None
+    if not check_crc(response):
+        metrics.count('modbus.crc_error')
+        print("Error: CRC check failed")
+        return None
+    return response
+
+
+def send_request(ser, request, response_length, t35=None, timeout=1.0):
+    crc = calculate_crc(request)
+    return send_frame(ser, request + struct.pack('<H', crc), response_length, t35, timeout)
+
+
+class ModbusRtuSession:
+    """Long-lived Modbus RTU connection to one serial port.
+
+    The port is opened lazily on the first transaction and kept open until
+    close(). All transactions go through a single lock so several threads
+    can share one RS-485 line. A serial error drops the handle and the
+    transaction is retried on a freshly opened port. last_exception is the
+    exception code of the calling thread's last read or write when the
+    drive rejected it, None when it succeeded or got no valid reply.
+    """
+
+    def __init__(self, port, baudrate=9600, timeout=1, retries=1):
+        self.port = port
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.retries = retries
+        self.t35 = silent_interval(baudrate)
+        self._ser = None
+        self._lock = threading.RLock()
+        self._builder = FrameBuilder()
+        self._last_frame_end = 0.0
+        self._local = threading.local()
+
+    @property
+    def last_exception(self):
+        return getattr(self._local, 'exception', None)
+
+    def _check_exception(self, response):
+        # Exception replies answer function code | 0x80; remembered for the calling thread
+        self._local.exception = response[2] if response is not None and response[1] & 0x80 else None
+        if self._local.exception is not None:
+            print(f"Modbus exception response: {response[2]}")
+            return True
+        return False
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def is_open(self):
+        return self._ser is not None and self._ser.is_open
+
+    def open(self):
+        with self._lock:
+            if not self.is_open:
+                self._ser = open_serial_port(self.port, self.baudrate, self.timeout)
+            return self._ser
+
+    def close(self):
+        with self._lock:
+            if self._ser is not None:
+                try:
+                    self._ser.close()
+                except serial.SerialException:
+                    pass
+                self._ser = None
+
+    def transaction(self, request, response_length):
+        # request is a PDU without CRC, as for send_request().
+        with self._lock:
+            return self.send_frame(self._builder.raw(request), response_length)
+
+    def send_frame(self, frame, response_length):
+        waited = metrics.start()
+        with self._lock:
+            metrics.observe('modbus.lock_wait', waited)
+            for attempt in range(self.retries + 1):
+                try:
+                    ser = self.open()
+                    # The bus has to stay silent for t3.5 between frames.
+                    gap = self._last_frame_end + self.t35 - time.monotonic()
+                    if gap > 0:
+                        time.sleep(gap)
+                    debug = logger.isEnabledFor(logging.DEBUG)
+                    if debug:
+                        logger.debug("%s request: %s", self.port, frame.hex())
+                    response = send_frame(ser, frame, response_length, self.t35, self.timeout)
+                    self._last_frame_end = time.monotonic()
+                    if debug and response is not None:
+                        logger.debug("%s response: %s", self.port, response.hex())
+                    return response
+                except (serial.SerialException, OSError) as e:
+                    metrics.count('modbus.serial_error')
+                    print(f"Exception on {self.port} (attempt {attempt + 1}): {e}")
+                    self.close()
+            return None
+
+    def read_multiple_registers(self, slave_address, register_address, count):
+        with self._lock:
+            frame = self._builder.read_registers(slave_address, register_address, count)
+            response = self.send_frame(frame, 5 + 2 * count)
+        if self._check_exception(response) or response is None:
+            return None
+        return struct.unpack_from('>%dH' % count, response, 3)
+
+    def read_register(self, slave_address, register_address):
+        values = self.read_multiple_registers(slave_address, register_address, 1)
+        if values is None:
+            return None
+        return values[0]
+
+    def write_single_register(self, slave_address, register_address, value):
+        function_code = 0x06
+        with self._lock:
+            response = self.send_frame(self._builder.write_single_register(slave_address, register_address, value), 8)
+        if self._check_exception(response) or response is None:
+            return False
+        if struct.unpack_from('>BBHH', response) != (slave_address, function_code, register_address, value):
+            print("Error: Response does not match the request")
+            return False
+        return True
+
+    def write_multiple_registers(self, slave_address, register_address, values):
+        function_code = 0x10
+        quantity_of_registers = len(values)
+        with self._lock:
+            response = self.send_frame(self._builder.write_multiple_registers(slave_address, register_address, values), 8)
+        if self._check_exception(response) or response is None:
+            return False
+        if struct.unpack_from('>BBHH', response) != (slave_address, function_code, register_address, quantity_of_registers):
+            print("Error: Response does not match the request")
+            return False
+        return True
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(port, baudrate=9600):
+    # One session per port: every caller addressing the same bus shares the handle and its lock.
+    with _sessions_lock:
+        session = _sessions.get(port)
+        if session is None:
+            session = ModbusRtuSession(port, baudrate)
+            _sessions[port] = session
+        elif session.baudrate != baudrate:
+            raise ValueError(f"{port} already open at {session.baudrate} baud, requested {baudrate}")
+        return session
+
+
+def close_all_sessions():
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
@@ -0,0 +1,132 @@
+import time
+from collections import namedtuple
+
+from register_map import SERVO_REGISTERS
+
+# 100000 pulses per motor revolution x 30:1 gearbox = 3,000,000 pulses per table revolution
+PULSES_PER_TABLE_DEGREE = 3000000 / 360
+
+# reason: 'in_position', 'settled', 'timeout', 'fault', 'no_feedback' or 'stopped'
+MotionResult = namedtuple('MotionResult', 'reached angle pulses elapsed reason')
+
+
+class MotionMonitor:
+    """Waits for a servo move to finish by polling the drive.
+
+    Each poll reads the 32-bit position feedback at 0x0012/0x0013, and the
+    drive's status word when status_address is given: in_position_bit and
+    fault_bit are masks of its bits, from the drive manual. Without it a
+    move is done once the feedback settles. The poll interval adapts to
+    the move: half the estimated time to reach the target, clamped to
+    [min_interval, max_interval], so a long move costs few transactions
+    while the end of every move is caught within a few milliseconds.
+    """
+
+    def __init__(self, session, slave_address, register_map=SERVO_REGISTERS,
+                 pulses_per_degree=PULSES_PER_TABLE_DEGREE, tolerance_pulses=50,
+                 min_interval=0.005, max_interval=0.1, settle_samples=3, max_read_failures=3,
+                 status_address=None, in_position_bit=0, fault_bit=0):
+        self.session = session
+        self.slave_address = slave_address
+        self.register_map = register_map
+        self.pulses_per_degree = pulses_per_degree
+        self.tolerance_pulses = tolerance_pulses
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.settle_samples = settle_samples
+        self.max_read_failures = max_read_failures
+        self.status_address = status_address
+        self.in_position_bit = in_position_bit
+        self.fault_bit = fault_bit
+        self._status_supported = status_address is not None
+
+    def read_feedback(self):
+        register = self.register_map['position_feedback']
+        words = self.session.read_multiple_registers(self.slave_address, register.address, register.width)
+        if words is None:
+            return None
+        return self.register_map.decode('position_feedback', words, signed=True)
+
+    def read_status(self):
+        if not self._status_supported:
+            return None
+        status = self.session.read_register(self.slave_address, self.status_address)
+        if status is None and self.session.last_exception is not None:
+            # Drive without (or rejecting) the status word: rely on feedback settling from now on.
+            # A timeout or CRC error says nothing about the register, so the next poll tries again.
+            self._status_supported = False
+        return status
+
+    def _result(self, reached, start_pulses, pulses, started, reason):
+        angle = None
+        if pulses is not None and start_pulses is not None:
+            angle = (pulses - start_pulses) / self.pulses_per_degree
+        return MotionResult(reached, angle, pulses, time.monotonic() - started, reason)
+
+    def wait(self, target_pulses=None, start_pulses=None, timeout=30.0, stop=None, moving=False):
+        """Block until the move ends; returns a MotionResult.
+
+        target_pulses is the absolute feedback value the move should end at.
+        Without it the move is considered done once the feedback has moved
+        (or at once with moving=True, for a table already under way) and then
+        stayed put for settle_samples polls. The reported angle is relative
+        to start_pulses (table degrees). Setting the threading.Event stop
+        ends the wait between polls with reason 'stopped'.
+        """
+        started = time.monotonic()
+        last_pulses = start_pulses
+        last_time = started
+        moved = moving
+        stable = 0
+        failures = 0
+        pulses = None
+        while True:
+            status = self.read_status()
+            if status is not None and status & self.fault_bit:
+                return self._result(False, start_pulses, pulses, started, 'fault')
+
+            now = time.monotonic()
+            sample = self.read_feedback()
+            if sample is None:
+                failures += 1
+                if failures >= self.max_read_failures:
+                    return self._result(False, start_pulses, pulses, started, 'no_feedback')
+            else:
+                failures = 0
+                pulses = sample
+                if start_pulses is None:
+                    start_pulses = pulses
+
+            velocity = 0.0
+            if pulses is not None and last_pulses is not None:
+                delta = abs(pulses - last_pulses)
+                if delta > self.tolerance_pulses:
+                    moved = True
+                    stable = 0
+                    velocity = delta / max(now - last_time, 1e-6)
+                else:
+                    stable += 1
+            last_pulses, last_time = pulses, now
+
+            if pulses is not None:
+                near = target_pulses is None or abs(target_pulses - pulses) <= self.tolerance_pulses
+                in_position = status is not None and status & self.in_position_bit
+                if near and in_position and (moved or target_pulses is not None):
+                    return self._result(True, start_pulses, pulses, started, 'in_position')
+                if near and stable >= self.settle_samples and (moved or target_pulses is not None):
+                    return self._result(True, start_pulses, pulses, started, 'settled')
+
+            if now - started >= timeout:
+                return self._result(False, start_pulses, pulses, started, 'timeout')
+
+            interval = self.min_interval
+            if velocity > 0 and target_pulses is not None:
+                interval = abs(target_pulses - pulses) / velocity / 2
+            elif not moved:
+                # Not moving yet: back off gently until the drive starts.
+                interval = self.min_interval * (1 + stable)
+            interval = min(max(interval, self.min_interval), self.max_interval)
+            if stop is None:
+                time.sleep(interval)
+            elif stop.wait(interval):
+                return self._result(False, start_pulses, pulses, started, 'stopped')
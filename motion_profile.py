@@ -0,0 +1,113 @@
+from functools import lru_cache
+
+import numpy as np
+
+# Speeds are in steps/s, accelerations in steps/s^2. A profile is the array
+# of per-step half-periods in seconds, ready for step_engine.compile_move().
+
+PROFILE_CACHE_SIZE = 64
+
+
+def _freeze(delays):
+    # Cached arrays are shared between callers, so make them read-only.
+    delays.flags.writeable = False
+    return delays
+
+
+def _trapezoid(steps, vmax, accel, vstart):
+    # Speed at the middle of each step: limited by the acceleration ramp, the
+    # deceleration ramp mirrored from the end, and vmax.
+    s = np.arange(steps, dtype=np.float64) + 0.5
+    v = np.sqrt(np.minimum(vstart * vstart + 2.0 * accel * s,
+                           vstart * vstart + 2.0 * accel * (steps - s)))
+    np.minimum(v, vmax, out=v)
+    return 0.5 / v
+
+
+def _s_curve(steps, vmax, accel, vstart, samples=512):
+    # Sine-shaped speed ramps (jerk limited, peak acceleration = accel).
+    # Ramp distance for a ramp to vpeak is pi * (vpeak^2 - vstart^2) / (4 * accel);
+    # short moves lower vpeak so the two ramps meet in the middle.
+    vpeak = min(vmax, np.sqrt(vstart * vstart + 2.0 * accel * steps / np.pi))
+    ramp_time = np.pi * (vpeak - vstart) / (2.0 * accel)
+    ramp_steps = np.pi * (vpeak * vpeak - vstart * vstart) / (4.0 * accel)
+    cruise_time = max(steps - 2.0 * ramp_steps, 0.0) / vpeak
+
+    u = np.linspace(0.0, 1.0, samples)
+    ramp_v = vstart + (vpeak - vstart) * (1.0 - np.cos(np.pi * u)) / 2.0
+    ramp_t = u * ramp_time
+    t = np.concatenate([ramp_t, ramp_time + cruise_time + ramp_t[1:]])
+    v = np.concatenate([ramp_v, ramp_v[-2::-1]])
+
+    # Integrate speed to position, then find the time each whole step is reached.
+    position = np.concatenate([[0.0], np.cumsum(np.diff(t) * (v[1:] + v[:-1]) / 2.0)])
+    position *= steps / position[-1]
+    step_times = np.interp(np.arange(1, steps + 1, dtype=np.float64), position, t)
+    periods = np.diff(step_times, prepend=0.0)
+    # Guard the first step against a zero-length period when vstart is tiny.
+    periods[0] = max(periods[0], 1.0 / vpeak)
+    return periods / 2.0
+
+
+@lru_cache(maxsize=PROFILE_CACHE_SIZE)
+def trapezoid_delays(steps, vmax, accel, vstart):
+    return _freeze(_trapezoid(steps, vmax, accel, vstart))
+
+
+@lru_cache(maxsize=PROFILE_CACHE_SIZE)
+def s_curve_delays(steps, vmax, accel, vstart):
+    return _freeze(_s_curve(steps, vmax, accel, vstart))
+
+
+PROFILES = {
+    'trapezoid': trapezoid_delays,
+    's_curve': s_curve_delays,
+}
+
+
+def step_delays(steps, vmax, accel, vstart=None, profile='trapezoid'):
+    """Per-step half-periods for a move of steps steps.
+
+    vstart is the speed the motor can start and stop at without ramping
+    (defaults to a tenth of vmax). Results are cached per
+    (steps, vmax, accel, vstart) with LRU eviction, so repeated capture
+    angles reuse the same array.
+    """
+    if steps <= 0:
+        return _freeze(np.empty(0))
+    if vstart is None:
+        vstart = vmax / 10.0
+    vstart = min(vstart, vmax)
+    return PROFILES[profile](int(steps), float(vmax), float(accel), float(vstart))
+
+
+@lru_cache(maxsize=PROFILE_CACHE_SIZE)
+def _ramp(v0, v1, accel):
+    steps = int(abs(v1 * v1 - v0 * v0) / (2.0 * accel))
+    s = np.arange(steps, dtype=np.float64) + 0.5
+    if v1 > v0:
+        v = np.sqrt(v0 * v0 + 2.0 * accel * s)
+    else:
+        v = np.maximum(np.sqrt(np.maximum(v0 * v0 - 2.0 * accel * s, 0.0)), v1)
+    return _freeze(0.5 / v)
+
+
+def ramp_delays(v0, v1, accel):
+    """Per-step half-periods changing speed from v0 to v1 (both > 0) at accel."""
+    if v0 == v1:
+        return _freeze(np.empty(0))
+    return _ramp(float(v0), float(v1), float(accel))
+
+
+@lru_cache(maxsize=PROFILE_CACHE_SIZE)
+def cruise_delays(steps, v):
+    """steps half-periods at constant speed v."""
+    return _freeze(np.full(int(steps), 0.5 / float(v)))
+
+
+def profile_duration(delays):
+    return 2.0 * float(np.sum(delays))
+
+
+def cache_info():
+    return {name: function.cache_info() for name, function in PROFILES.items()}
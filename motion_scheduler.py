@@ -0,0 +1,136 @@
+import itertools
+import threading
+import time
+from collections import deque
+
+
+class MotionJob:
+    def __init__(self, job_id, angle, action="turn", plan=None, speed=None):
+        self.id = job_id
+        self.action = action
+        self.angle = angle
+        self.plan = plan  # stops of a "scan" job
+        self.speed = speed  # table rpm of a "spin" job
+        self.status = "queued"  # queued, started, completed, cancelled, error
+        self.error = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.merged = []  # jobs coalesced into this one
+
+
+class MotionScheduler:
+    """Runs motion jobs on one executor thread, fed by a bounded queue.
+
+    submit() returns at once, so the thread receiving commands is never
+    held up by a move. execute(job) performs the move and may raise to
+    report an error; abort() is called by stop() to interrupt the running
+    move. on_event(event, job) is called from the executor thread for
+    'started', 'completed', 'cancelled' and 'error', and from the calling
+    thread for jobs cancelled while still queued.
+
+    With coalesce=True consecutive queued relative turns are merged into a
+    single move when the executor picks them up.
+    """
+
+    def __init__(self, execute, on_event, abort=None, max_queue=16, coalesce=False):
+        self._execute = execute
+        self._on_event = on_event
+        self._abort = abort
+        self.max_queue = max_queue
+        self.coalesce = coalesce
+        self._queue = deque()
+        self._condition = threading.Condition()
+        self._current = None
+        self._ids = itertools.count(1)
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="motion-executor", daemon=True)
+        self._thread.start()
+
+    @property
+    def busy(self):
+        with self._condition:
+            return self._current is not None or bool(self._queue)
+
+    @property
+    def current(self):
+        with self._condition:
+            return self._current
+
+    def pending(self):
+        with self._condition:
+            return len(self._queue)
+
+    def submit(self, angle, action="turn", plan=None, speed=None):
+        """Queue a move; returns the job, or None when the queue is full."""
+        with self._condition:
+            if self._closed or len(self._queue) >= self.max_queue:
+                return None
+            job = MotionJob(next(self._ids), angle, action, plan, speed)
+            self._queue.append(job)
+            self._condition.notify()
+            return job
+
+    def cancel(self, job_id=None):
+        """Drop one queued job (or all of them); returns the cancelled jobs."""
+        with self._condition:
+            cancelled = [job for job in self._queue if job_id is None or job.id == job_id]
+            for job in cancelled:
+                self._queue.remove(job)
+        for job in cancelled:
+            job.status = "cancelled"
+            job.finished = time.time()
+            self._on_event("cancelled", job)
+        return cancelled
+
+    def stop(self):
+        """Cancel everything queued and interrupt the running move."""
+        cancelled = self.cancel()
+        # Marked under the lock _run() starts jobs under, so the job either starts already
+        # cancelled or is cancelled after it started, never overwritten by "started"
+        with self._condition:
+            current = self._current
+            if current is not None:
+                current.status = "cancelled"
+        if current is not None and self._abort is not None:
+            self._abort()
+        return cancelled, current
+
+    def close(self, timeout=None):
+        self.stop()
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join(timeout)
+
+    def _take(self):
+        job = self._queue.popleft()
+        if self.coalesce and job.action == "turn":
+            while self._queue and self._queue[0].action == "turn":
+                merged = self._queue.popleft()
+                job.angle += merged.angle
+                job.merged.append(merged)
+        return job
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._queue and not self._closed:
+                    self._condition.wait()
+                if self._closed:
+                    return
+                job = self._current = self._take()
+                job.status = "started"
+                job.started = time.time()
+            self._on_event("started", job)
+            try:
+                self._execute(job)
+            except Exception as e:
+                job.status = "error"
+                job.error = str(e)
+            job.finished = time.time()
+            with self._condition:
+                if job.status == "started":
+                    job.status = "completed"
+                self._current = None
+            self._on_event(job.status, job)
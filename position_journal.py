@@ -0,0 +1,83 @@
+import mmap
+import os
+import struct
+import threading
+import zlib
+from collections import namedtuple
+
+JOURNAL_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'position_journal.bin')
+
+# state: RUNNING while the service owns the table, CLEAN after an orderly shutdown
+STATE_RUNNING = 0
+STATE_CLEAN = 1
+
+PositionRecord = namedtuple('PositionRecord', 'sequence angle steps homed state')
+
+# magic, version, sequence, angle, steps, homed, state, crc32 of everything before it
+_RECORD = struct.Struct('<4sHQdqBBI')
+_MAGIC = b'TTPJ'
+_VERSION = 1
+_SLOT = 64  # two slots, written alternately, so a torn write never loses the previous record
+
+
+class PositionJournal:
+    """Memory-mapped, checksummed record of the table position.
+
+    Every write goes to the older of two slots with a higher sequence
+    number and is flushed to disk; load() returns the newest slot whose
+    CRC checks out. A crash in the middle of a write therefore leaves the
+    previous record intact.
+    """
+
+    def __init__(self, path=JOURNAL_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size < 2 * _SLOT:
+                os.ftruncate(fd, 2 * _SLOT)
+            self._mm = mmap.mmap(fd, 2 * _SLOT)
+        finally:
+            os.close(fd)
+        self._last = self.load()
+
+    def _read_slot(self, slot):
+        data = self._mm[slot * _SLOT:slot * _SLOT + _RECORD.size]
+        magic, version, sequence, angle, steps, homed, state, crc = _RECORD.unpack(data)
+        if magic != _MAGIC or version != _VERSION or zlib.crc32(data[:-4]) != crc:
+            return None
+        return PositionRecord(sequence, angle, steps, bool(homed), state)
+
+    def load(self):
+        records = [record for record in (self._read_slot(0), self._read_slot(1)) if record is not None]
+        return max(records, key=lambda record: record.sequence) if records else None
+
+    @property
+    def last(self):
+        return self._last
+
+    def write(self, angle, steps, homed, state=STATE_RUNNING):
+        with self._lock:
+            sequence = self._last.sequence + 1 if self._last else 1
+            slot = sequence % 2
+            body = _RECORD.pack(_MAGIC, _VERSION, sequence, angle, steps, int(homed), state, 0)[:-4]
+            offset = slot * _SLOT
+            self._mm[offset:offset + _RECORD.size] = body + struct.pack('<I', zlib.crc32(body))
+            self._mm.flush()
+            self._last = PositionRecord(sequence, angle, steps, bool(homed), state)
+            return self._last
+
+    def close(self, clean=True):
+        """Mark an orderly shutdown (clean=True) and unmap the file."""
+        with self._lock:
+            last = self._last
+        if clean and last is not None:
+            self.write(last.angle, last.steps, last.homed, STATE_CLEAN)
+        self._mm.close()
+
+
+def trusted_position(record):
+    """The record to resume from without homing, or None if homing is needed."""
+    if record is None or record.state != STATE_CLEAN or not record.homed:
+        return None
+    return record
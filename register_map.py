@@ -0,0 +1,196 @@
+import threading
+from collections import namedtuple
+
+from modbus_rtu import get_session
+
+# width is in 16-bit registers. 32-bit values are stored low word first,
+# matching split_to_registers() in the scripts. volatile registers are
+# commands (e.g. the PR trigger) that must be sent every time and are never
+# merged with neighbouring writes.
+Register = namedtuple('Register', 'name address width writable volatile')
+
+
+def _reg(name, address, width=1, writable=True, volatile=False):
+    return Register(name, address, width, writable, volatile)
+
+
+class RegisterMap:
+    def __init__(self, registers):
+        self._by_name = {register.name: register for register in registers}
+
+    def __getitem__(self, name):
+        return self._by_name[name]
+
+    def __iter__(self):
+        return iter(self._by_name.values())
+
+    def encode(self, name, value):
+        # -> [(address, word), ...]
+        register = self[name]
+        if not register.writable:
+            raise ValueError(f"Register {name} is read-only")
+        value &= (1 << (16 * register.width)) - 1
+        return [(register.address + i, (value >> (16 * i)) & 0xFFFF) for i in range(register.width)]
+
+    def decode(self, name, words, signed=False):
+        register = self[name]
+        value = 0
+        for i, word in enumerate(words[:register.width]):
+            value |= word << (16 * i)
+        bits = 16 * register.width
+        if signed and value & (1 << (bits - 1)):
+            value -= 1 << bits
+        return value
+
+
+# pr_mode of point-to-point position moves, the value the original scripts always sent.
+# Constant speed (jog) has a pr_mode of its own that differs between drives: it is not
+# defined here but passed in (a servo table's velocity_mode config key).
+PR_MODE_POSITION = 130
+
+SERVO_REGISTERS = RegisterMap([
+    _reg('position_feedback', 0x0012, 2, writable=False),
+    _reg('servo_on', 0x023C),
+    _reg('trigger', 0x050E, volatile=True),
+    _reg('accel_decel_ms', 0x0528),  # 30 to 8000 ms
+    _reg('speed_rpm', 0x0578, 2),
+    _reg('pr_mode', 0x0604, 2),  # PR_MODE_POSITION or the drive's velocity mode
+    _reg('target_pulses', 0x0606, 2),
+])
+
+MAX_WRITE_REGISTERS = 123  # Modbus limit for function 0x10
+
+
+def position_move_updates(pulses, speed, accel_ms):
+    # A point-to-point move of pulses (relative) at speed_rpm, triggered once the rest is written
+    return [
+        ('servo_on', 1),
+        ('accel_decel_ms', accel_ms),
+        ('speed_rpm', speed),
+        ('pr_mode', PR_MODE_POSITION),
+        ('target_pulses', pulses),
+        ('trigger', 1),
+    ]
+
+
+def velocity_updates(speed, accel_ms, velocity_mode):
+    # Constant speed_rpm (signed) until the next trigger in the drive's velocity pr_mode;
+    # speed 0 ramps down to a stop
+    return [
+        ('servo_on', 1),
+        ('accel_decel_ms', accel_ms),
+        ('speed_rpm', speed),
+        ('pr_mode', velocity_mode),
+        ('trigger', 1),
+    ]
+
+
+def update_shadow(shadow, address, words, ok):
+    # After one write frame: remember its words, or forget them when it failed so they are resent
+    for i, word in enumerate(words):
+        if ok:
+            shadow[address + i] = word
+        else:
+            shadow.pop(address + i, None)
+
+
+def forget_volatile(register_map, shadow):
+    # Volatile registers are commands, never cached.
+    for register in register_map:
+        if register.volatile:
+            for i in range(register.width):
+                shadow.pop(register.address + i, None)
+
+
+def angle_to_pulses(angle):
+    # Motor angle in degrees -> target_pulses at the drive's 100000 pulses per motor revolution
+    pulses_per_rotation = 100000
+    degrees_per_rotation = 360
+    return int((angle / degrees_per_rotation) * pulses_per_rotation)
+
+
+def plan_writes(register_map, updates, shadow=None):
+    """Turn named updates into the fewest write frames.
+
+    updates is a sequence of (name, value). Registers whose words all match
+    the shadow are dropped, the remaining ones are sorted and runs of adjacent
+    addresses become one function 0x10 write (0x06 for a lone 16-bit
+    register).
+    Volatile registers are always sent, after the merged writes, in the
+    order given. Returns a list of (start_address, [words]).
+    """
+    shadow = shadow or {}
+    pending = {}
+    volatile = []
+    for name, value in updates:
+        encoded = register_map.encode(name, value)
+        if register_map[name].volatile:
+            volatile.append((encoded[0][0], [word for _, word in encoded]))
+        elif any(shadow.get(address) != word for address, word in encoded):
+            # A 32-bit pair is always written whole, never one half of it.
+            pending.update(encoded)
+    changed = sorted(pending.items())
+
+    writes = []
+    for address, word in changed:
+        if writes:
+            start, words = writes[-1]
+            if start + len(words) == address and len(words) < MAX_WRITE_REGISTERS:
+                words.append(word)
+                continue
+        writes.append((address, [word]))
+    return writes + volatile
+
+
+class RegisterPlanner:
+    """Shadow cache of the words last written to one slave.
+
+    write() only sends what changed since the previous successful write.
+    Any failed frame forgets its words so they are resent next time; call
+    invalidate() whenever the drive may have lost its settings (power
+    cycle, parameter reset from the front panel).
+    """
+
+    def __init__(self, session, slave_address, register_map=SERVO_REGISTERS):
+        self.session = session
+        self.slave_address = slave_address
+        self.register_map = register_map
+        self._shadow = {}
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        with self._lock:
+            self._shadow.clear()
+
+    def write(self, updates):
+        """Send updates; returns the (address, words, ok) frames sent.
+
+        Stops at the first failed frame so that a trailing command register
+        is never triggered with half-written parameters.
+        """
+        sent = []
+        with self._lock:
+            for address, words in plan_writes(self.register_map, updates, self._shadow):
+                if len(words) == 1:
+                    ok = self.session.write_single_register(self.slave_address, address, words[0])
+                else:
+                    ok = self.session.write_multiple_registers(self.slave_address, address, words)
+                sent.append((address, words, ok))
+                update_shadow(self._shadow, address, words, ok)
+                if not ok:
+                    break
+            forget_volatile(self.register_map, self._shadow)
+        return sent
+
+
+_planners = {}
+_planners_lock = threading.Lock()
+
+
+def get_planner(port, baudrate, slave_address):
+    with _planners_lock:
+        planner = _planners.get((port, slave_address))
+        if planner is None:
+            planner = RegisterPlanner(get_session(port, baudrate), slave_address)
+            _planners[(port, slave_address)] = planner
+        return planner
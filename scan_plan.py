@@ -0,0 +1,122 @@
+import threading
+import time
+from collections import namedtuple
+
+# seq: position in the plan; angle: table angle to stop at; dwell: seconds to hold there
+ScanStop = namedtuple('ScanStop', 'seq angle dwell capture')
+# steps: signed steps from the previous stop; waveform: what compile_turn built for them,
+# None when the table is already there
+ScanSegment = namedtuple('ScanSegment', 'stop steps waveform')
+
+MAX_STOPS = 3600
+
+
+def _number(value, name):
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError("%s must be a number" % name)
+    return value
+
+
+def parse_plan(message, current_angle=0.0):
+    """Turn a scan command into ScanStops, raising ValueError for a bad plan.
+
+    Either "angles": absolute table angles (numbers, or objects with
+    "angle" and optionally "dwell"/"capture" overriding the plan defaults),
+    or "stops": N stops "step" degrees apart (default 360/N) starting one
+    step on from current_angle. "dwell" (s) and "capture" apply to every
+    stop that does not set its own.
+    """
+    dwell = _number(message.get("dwell", 0.0), "dwell")
+    capture = bool(message.get("capture", True))
+    if dwell < 0:
+        raise ValueError("dwell must not be negative")
+
+    stops = []
+    if message.get("angles") is not None:
+        angles = message["angles"]
+        if not isinstance(angles, list) or not angles:
+            raise ValueError("angles must be a non-empty list")
+        for item in angles:
+            if isinstance(item, dict):
+                stop_dwell = _number(item.get("dwell", dwell), "dwell")
+                stops.append(ScanStop(len(stops), _number(item.get("angle"), "angle") % 360,
+                                      max(stop_dwell, 0.0), bool(item.get("capture", capture))))
+            else:
+                stops.append(ScanStop(len(stops), _number(item, "angle") % 360, dwell, capture))
+    elif message.get("stops") is not None:
+        count = message["stops"]
+        if isinstance(count, bool) or not isinstance(count, int) or count < 1:
+            raise ValueError("stops must be a positive integer")
+        step = _number(message.get("step", 360.0 / count), "step")
+        for seq in range(min(count, MAX_STOPS + 1)):
+            stops.append(ScanStop(seq, (current_angle + (seq + 1) * step) % 360, dwell, capture))
+    else:
+        raise ValueError("scan needs angles or stops")
+
+    if len(stops) > MAX_STOPS:
+        raise ValueError("at most %d stops per scan" % MAX_STOPS)
+    return stops
+
+
+def plan_segments(stops, start_steps, steps_per_rev, compile_turn):
+    """Precompute every move of a scan before the first one starts.
+
+    Each stop is reached by the shortest turn from the previous one;
+    compile_turn(steps) builds the waveform for a signed step count and is
+    called once per distinct count, so a regular scan compiles one move.
+    """
+    segments = []
+    compiled = {}
+    position = start_steps
+    for stop in stops:
+        target = int(round(stop.angle * steps_per_rev / 360.0))
+        delta = (target - position) % steps_per_rev
+        if delta > steps_per_rev // 2:
+            delta -= steps_per_rev
+        if delta and delta not in compiled:
+            compiled[delta] = compile_turn(delta)
+        segments.append(ScanSegment(stop, delta, compiled.get(delta)))
+        position += delta
+    return segments
+
+
+class ScanRunner:
+    """Plays precomputed scan segments back to back.
+
+    move(segment) performs one segment and returns the signed steps made,
+    which on_moved(steps) then reports; at each stop capture(stop) fires
+    first (e.g. a camera trigger pin), then on_stop(stop, timestamp), then
+    the dwell. A move more than tolerance steps short of its segment ends
+    the scan. stop() ends the scan at the next opportunity, interrupting a
+    dwell; the caller aborts the running move itself.
+    """
+
+    def __init__(self, move, on_stop, on_moved=None, capture=None, tolerance=0):
+        self.move = move
+        self.tolerance = tolerance
+        self.on_stop = on_stop
+        self.on_moved = on_moved
+        self.capture = capture
+        self._stopped = threading.Event()
+
+    def stop(self):
+        self._stopped.set()
+
+    def run(self, segments):
+        """Returns True when every stop was reached."""
+        for segment in segments:
+            if self._stopped.is_set():
+                return False
+            if segment.steps:
+                moved = self.move(segment)
+                if self.on_moved is not None:
+                    self.on_moved(moved)
+                if abs(moved) < abs(segment.steps) - self.tolerance:
+                    return False
+            arrived = time.time()
+            if segment.stop.capture and self.capture is not None:
+                self.capture(segment.stop)
+            self.on_stop(segment.stop, arrived)
+            if segment.stop.dwell and self._stopped.wait(segment.stop.dwell):
+                return False
+        return True
@@ -0,0 +1,493 @@
+"""Simulated hardware for running the turntable code off the Pi.
+
+SimulatedGPIO mimics the RPi.GPIO module API, SimulatedStepper turns the
+step/dir outputs into a table position with a virtual Hall sensor, and
+SimulatedServoDrive/SimulatedSerial answer Modbus RTU 0x03/0x06/0x10 on a
+virtual RS-485 line with wire timing, for ports named "sim://<bus>".
+"""
+import math
+import struct
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import parse_qs, urlparse
+
+from crc16 import calculate_crc, check_crc
+from register_map import PR_MODE_POSITION, SERVO_REGISTERS
+
+# pr_mode value of the simulated drive's velocity mode. A servo table on a "sim://" port
+# needs it as its velocity_mode, as a real one needs the value from its drive's manual.
+SIM_VELOCITY_MODE = 2
+# Read-only status word of the simulated drive and its in-position bit (it never faults),
+# for a servo table's status_address / status_in_position
+SIM_STATUS_ADDRESS = 0x0B05
+SIM_STATUS_IN_POSITION = 0x0001
+
+
+class SimulatedGPIO:
+    """In-memory stand-in for the RPi.GPIO module.
+
+    Event callbacks run synchronously in the thread that changed the level
+    (RPi.GPIO runs them on its own thread).
+    """
+
+    SIMULATED = True
+    BOARD = 10
+    BCM = 11
+    OUT = 0
+    IN = 1
+    LOW = 0
+    HIGH = 1
+    PUD_OFF = 20
+    PUD_DOWN = 21
+    PUD_UP = 22
+    RISING = 31
+    FALLING = 32
+    BOTH = 33
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._mode = None
+        self._levels = {}
+        self._directions = {}
+        self._watchers = defaultdict(list)
+        self._edge_detect = {}  # channel -> [edge, callbacks, detected]
+        self._edge_condition = threading.Condition(self._lock)
+
+    # RPi.GPIO API
+
+    def setwarnings(self, flag):
+        pass
+
+    def setmode(self, mode):
+        self._mode = mode
+
+    def getmode(self):
+        return self._mode
+
+    def setup(self, channel, direction, pull_up_down=PUD_OFF, initial=None):
+        for pin in self._channels(channel):
+            with self._lock:
+                self._directions[pin] = direction
+                if direction == self.OUT:
+                    self._levels[pin] = self.LOW if initial is None else initial
+                elif pin not in self._levels:
+                    self._levels[pin] = self.HIGH if pull_up_down == self.PUD_UP else self.LOW
+
+    def output(self, channel, value):
+        for pin in self._channels(channel):
+            self._set_level(pin, int(bool(value)))
+
+    def input(self, channel):
+        return self._levels.get(channel, self.LOW)
+
+    def cleanup(self, channel=None):
+        with self._lock:
+            pins = list(self._levels) if channel is None else self._channels(channel)
+            for pin in pins:
+                self._levels.pop(pin, None)
+                self._directions.pop(pin, None)
+                self._edge_detect.pop(pin, None)
+
+    def add_event_detect(self, channel, edge, callback=None, bouncetime=None):
+        with self._lock:
+            if channel in self._edge_detect:
+                raise RuntimeError("Conflicting edge detection already enabled for this GPIO channel")
+            self._edge_detect[channel] = [edge, [callback] if callback else [], False]
+
+    def add_event_callback(self, channel, callback):
+        with self._lock:
+            self._edge_detect[channel][1].append(callback)
+
+    def remove_event_detect(self, channel):
+        with self._lock:
+            self._edge_detect.pop(channel, None)
+
+    def event_detected(self, channel):
+        with self._lock:
+            detect = self._edge_detect.get(channel)
+            if detect is None or not detect[2]:
+                return False
+            detect[2] = False
+            return True
+
+    def wait_for_edge(self, channel, edge, bouncetime=None, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout / 1000.0
+        with self._lock:
+            added = channel not in self._edge_detect
+            if added:
+                self._edge_detect[channel] = [edge, [], False]
+            try:
+                while not self._edge_detect[channel][2]:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        return None
+                    self._edge_condition.wait(remaining)
+                self._edge_detect[channel][2] = False
+                return channel
+            finally:
+                if added:
+                    self._edge_detect.pop(channel, None)
+
+    # Simulation side
+
+    def watch(self, channel, callback):
+        """Call callback(channel, level) whenever an output changes level."""
+        self._watchers[channel].append(callback)
+
+    def drive_input(self, channel, level):
+        """Set an input pin from a simulated device, firing edge detection."""
+        self._set_level(channel, level)
+
+    def _channels(self, channel):
+        return channel if isinstance(channel, (list, tuple)) else [channel]
+
+    def _set_level(self, pin, level):
+        callbacks = ()
+        with self._lock:
+            previous = self._levels.get(pin, self.LOW)
+            self._levels[pin] = level
+            if previous == level:
+                return
+            detect = self._edge_detect.get(pin)
+            if detect is not None:
+                edge = detect[0]
+                rising = level == self.HIGH
+                if edge == self.BOTH or (edge == self.RISING) == rising:
+                    detect[2] = True
+                    callbacks = tuple(detect[1])
+                    self._edge_condition.notify_all()
+        for watcher in self._watchers.get(pin, ()):
+            watcher(pin, level)
+        for callback in callbacks:
+            callback(pin)
+
+
+class SimulatedStepper:
+    """Counts step pulses on a SimulatedGPIO and drives a virtual Hall sensor.
+
+    A step is a rising edge on the pulse pin; the direction pin at LOW is a
+    positive move (rotate() uses LOW for positive angles). The Hall input
+    reads HIGH while the table is within magnet_width steps of
+    magnet_step, like the real magnet that is detected early.
+    """
+
+    def __init__(self, gpio, pul_pin, dir_pin, hall_pin=None, steps_per_rev=12800,
+                 position=0, magnet_step=0, magnet_width=60, forward_level=0):
+        self.gpio = gpio
+        self.pul_pin = pul_pin
+        self.dir_pin = dir_pin
+        self.hall_pin = hall_pin
+        self.steps_per_rev = steps_per_rev
+        self.position = position
+        self.magnet_step = magnet_step
+        self.magnet_width = magnet_width
+        self.forward_level = forward_level
+        self.steps = 0
+        gpio.watch(pul_pin, self._on_pulse)
+        self._update_hall()
+
+    @property
+    def angle(self):
+        return (self.position % self.steps_per_rev) * 360.0 / self.steps_per_rev
+
+    def _on_pulse(self, pin, level):
+        if level != self.gpio.HIGH:
+            return
+        self.position += 1 if self.gpio.input(self.dir_pin) == self.forward_level else -1
+        self.steps += 1
+        self._update_hall()
+
+    def _update_hall(self):
+        if self.hall_pin is None:
+            return
+        offset = (self.position - self.magnet_step) % self.steps_per_rev
+        distance = min(offset, self.steps_per_rev - offset)
+        level = self.gpio.HIGH if distance <= self.magnet_width // 2 else self.gpio.LOW
+        if self.gpio.input(self.hall_pin) != level:
+            self.gpio.drive_input(self.hall_pin, level)
+
+
+class SimulatedServoDrive:
+    """Modbus servo drive answering 0x03/0x06/0x10 with simulated motion.
+
+    Writing 1 to the trigger register starts a relative point-to-point move
+    of target_pulses at speed_rpm (0.1 rpm units) with a trapezoidal ramp
+    that reaches full speed in accel_decel_ms. In velocity mode the trigger
+    instead ramps from the current speed to the signed speed_rpm and holds
+    it (0 stops), taking over from a point-to-point move still under way.
+    Position feedback and the in-position bit of the status word at
+    SIM_STATUS_ADDRESS follow the motion. A pr_mode other than PR_MODE_POSITION and velocity_mode is
+    refused with exception 3 (illegal data value).
+    """
+
+    def __init__(self, slave_address=1, register_map=SERVO_REGISTERS, pulses_per_rev=100000,
+                 processing_time=0.001, velocity_mode=SIM_VELOCITY_MODE):
+        self.slave_address = slave_address
+        self.velocity_mode = velocity_mode
+        self.register_map = register_map
+        self.pulses_per_rev = pulses_per_rev
+        self.processing_time = processing_time
+        self.registers = {}
+        self.position = 0
+        self._move = None  # (start time, start position, distance, speed, accel)
+        self._jog = None  # (start time, start position, start speed, speed, accel), signed pulses/s
+        self._lock = threading.Lock()
+        self.requests = 0
+
+    def _word(self, name):
+        register = self.register_map[name]
+        words = [self.registers.get(register.address + i, 0) for i in range(register.width)]
+        return self.register_map.decode(name, words, signed=True)
+
+    def _start_move(self, now):
+        self._settle(now)
+        if self._word('pr_mode') == self.velocity_mode:
+            self._start_jog(now)
+            return
+        self._stop_jog(now)
+        speed = max(self._word('speed_rpm'), 1) / 10.0 / 60.0 * self.pulses_per_rev
+        accel = speed / max(self._word('accel_decel_ms') / 1000.0, 0.001)
+        self._move = (now, self.position, self._word('target_pulses'), speed, accel)
+
+    def _jog_state(self, now):
+        # (position, speed) of the jog at time now
+        start, origin, v0, v1, accel = self._jog
+        t = now - start
+        ramp_time = abs(v1 - v0) / accel
+        if t < ramp_time:
+            speed = v0 + math.copysign(accel * t, v1 - v0)
+            return origin + (v0 + speed) / 2 * t, speed
+        return origin + (v0 + v1) / 2 * ramp_time + v1 * (t - ramp_time), v1
+
+    def _start_jog(self, now):
+        if self._jog is not None:
+            position, speed = self._jog_state(now)
+        else:
+            position, speed = self.position, 0.0
+            if self._move is not None:
+                # Velocity mode takes over a running move at its current speed
+                speed = self._move_speed(now)
+                self._move = None
+        target = self._word('speed_rpm') / 10.0 / 60.0 * self.pulses_per_rev
+        full_speed = max(abs(target), abs(speed), 1.0)
+        accel = full_speed / max(self._word('accel_decel_ms') / 1000.0, 0.001)
+        self._jog = (now, position, speed, target, accel)
+
+    def _stop_jog(self, now):
+        # A position move interrupts a jog where it is
+        if self._jog is not None:
+            self.position = int(self._jog_state(now)[0])
+            self._jog = None
+
+    def _profile(self):
+        # (peak speed, ramp length, ramp time, total time) of the point-to-point move
+        start, origin, distance, speed, accel = self._move
+        length = abs(distance)
+        ramp = speed * speed / (2 * accel)
+        if 2 * ramp > length:
+            # Triangular profile
+            speed = math.sqrt(length * accel)
+            ramp = length / 2
+        ramp_time = speed / accel
+        return speed, ramp, ramp_time, 2 * ramp_time + (length - 2 * ramp) / speed
+
+    def _move_speed(self, now):
+        # Signed speed of the point-to-point move at time now
+        start, origin, distance, _, accel = self._move
+        speed, ramp, ramp_time, total = self._profile()
+        t = now - start
+        if t >= total:
+            return 0.0
+        return math.copysign(min(speed, accel * t, accel * (total - t)), distance)
+
+    def _settle(self, now):
+        if self._move is None:
+            return True
+        start, origin, distance, _, accel = self._move
+        length = abs(distance)
+        speed, ramp, ramp_time, total = self._profile()
+        t = now - start
+        if t >= total:
+            travelled = length
+        elif t < ramp_time:
+            travelled = accel * t * t / 2
+        elif t < total - ramp_time:
+            travelled = ramp + speed * (t - ramp_time)
+        else:
+            remaining = total - t
+            travelled = length - accel * remaining * remaining / 2
+        self.position = origin + int(math.copysign(travelled, distance))
+        if t >= total:
+            self._move = None
+            return True
+        return False
+
+    def _refresh(self, now):
+        in_position = self._settle(now)
+        if self._jog is not None:
+            position, speed = self._jog_state(now)
+            self.position = int(position)
+            in_position = speed == 0
+        feedback = self.register_map['position_feedback']
+        for address, word in _words(feedback.address, self.position, feedback.width):
+            self.registers[address] = word
+        self.registers[SIM_STATUS_ADDRESS] = SIM_STATUS_IN_POSITION if in_position else 0
+
+    def handle(self, request):
+        """Reply frame for a request frame, or b'' when the drive stays silent."""
+        if len(request) < 8 or request[0] != self.slave_address or not check_crc(request):
+            return b''
+        with self._lock:
+            self.requests += 1
+            now = time.monotonic()
+            self._refresh(now)
+            function_code = request[1]
+            address, value = struct.unpack_from('>HH', request, 2)
+            if function_code == 0x03:
+                pdu = struct.pack('>BBB', self.slave_address, 0x03, 2 * value) + b''.join(
+                    struct.pack('>H', self.registers.get(address + i, 0)) for i in range(value))
+            elif function_code in (0x06, 0x10):
+                words = [value] if function_code == 0x06 else struct.unpack_from('>%dH' % value, request, 7)
+                if self._write(address, words, now):
+                    pdu = bytes(request[:6])
+                else:
+                    pdu = struct.pack('>BBB', self.slave_address, function_code | 0x80, 0x03)
+            else:
+                pdu = struct.pack('>BBB', self.slave_address, function_code | 0x80, 0x01)
+        return pdu + struct.pack('<H', calculate_crc(pdu))
+
+    def _write(self, address, words, now):
+        # False (and nothing written) for a pr_mode this drive does not have
+        previous = dict(self.registers)
+        for i, word in enumerate(words):
+            self.registers[address + i] = word
+        if self._word('pr_mode') not in (0, PR_MODE_POSITION, self.velocity_mode):
+            self.registers = previous
+            return False
+        if address == self.register_map['trigger'].address and words[0] == 1:
+            self._start_move(now)
+        return True
+
+
+def _words(address, value, width):
+    value &= (1 << (16 * width)) - 1
+    return [(address + i, (value >> (16 * i)) & 0xFFFF) for i in range(width)]
+
+
+class SimulatedBus:
+    """One RS-485 line with any number of simulated drives."""
+
+    def __init__(self, slaves=(1,)):
+        self.drives = {address: SimulatedServoDrive(address) for address in slaves}
+        self.lock = threading.Lock()
+
+    def handle(self, request):
+        for drive in self.drives.values():
+            reply = drive.handle(request)
+            if reply:
+                return reply, drive.processing_time
+        return b'', 0.0
+
+
+_buses = {}
+_buses_lock = threading.Lock()
+
+
+def get_bus(name, slaves=(1,)):
+    with _buses_lock:
+        bus = _buses.get(name)
+        if bus is None:
+            bus = _buses[name] = SimulatedBus(slaves)
+        return bus
+
+
+class SimulatedSerial:
+    """pyserial-like port on a SimulatedBus with realistic wire timing.
+
+    Each reply byte becomes readable one character time (11 bits) after the
+    previous one, starting when the request has been clocked out and the
+    drive has processed it. read() honours timeout and inter_byte_timeout
+    like pyserial.
+    """
+
+    def __init__(self, bus, baudrate=9600, timeout=1, port=None):
+        self.bus = bus
+        self.port = port
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.inter_byte_timeout = None
+        self.is_open = True
+        self._pending = b''
+        self._first_byte_at = 0.0
+        self.bytes_written = 0
+
+    @property
+    def char_time(self):
+        return 11.0 / self.baudrate
+
+    def _available(self, now):
+        if not self._pending:
+            return 0
+        if now < self._first_byte_at:
+            return 0
+        return min(len(self._pending), int((now - self._first_byte_at) / self.char_time) + 1)
+
+    @property
+    def in_waiting(self):
+        return self._available(time.monotonic())
+
+    def reset_input_buffer(self):
+        dropped = self._available(time.monotonic())
+        self._pending = self._pending[dropped:]
+        self._first_byte_at += dropped * self.char_time
+
+    def write(self, data):
+        data = bytes(data)
+        self.bytes_written += len(data)
+        with self.bus.lock:
+            reply, processing = self.bus.handle(data)
+        sent_at = time.monotonic() + len(data) * self.char_time
+        self._pending = reply
+        self._first_byte_at = sent_at + processing + self.char_time
+        return len(data)
+
+    def read(self, size=1):
+        start = time.monotonic()
+        deadline = None if self.timeout is None else start + self.timeout
+        last_byte = start
+        data = bytearray()
+        while len(data) < size:
+            now = time.monotonic()
+            available = self._available(now)
+            if available:
+                take = min(available, size - len(data))
+                data += self._pending[:take]
+                self._pending = self._pending[take:]
+                self._first_byte_at += take * self.char_time
+                last_byte = now
+                continue
+            limit = deadline
+            if data and self.inter_byte_timeout is not None:
+                gap_limit = last_byte + self.inter_byte_timeout
+                limit = gap_limit if limit is None else min(limit, gap_limit)
+            next_byte = self._first_byte_at if self._pending else math.inf
+            if limit is not None and next_byte > limit:
+                if limit > now:
+                    time.sleep(limit - now)
+                break
+            if next_byte == math.inf:
+                break
+            time.sleep(max(next_byte - now, 0))
+        return bytes(data)
+
+    def close(self):
+        self.is_open = False
+
+
+def open_serial(url, baudrate=9600, timeout=1):
+    """Open "sim://<bus>[?slaves=1,2]" as a SimulatedSerial."""
+    parsed = urlparse(url)
+    query = parse_qs(parsed.query)
+    slaves = tuple(int(address) for address in query.get('slaves', ['1'])[0].split(','))
+    return SimulatedSerial(get_bus(parsed.netloc or 'default', slaves), baudrate, timeout, port=url)
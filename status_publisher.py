@@ -0,0 +1,162 @@
+import json
+import math
+import struct
+import threading
+import time
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# State codes for the binary encoding; the order is part of the wire format.
+STATES = ('idle', 'queued', 'started', 'processing', 'completed', 'cancelled', 'error',
+          'connected', 'not_connected', 'at_angle', 'spin_speed', 'angle_at', 'ready')
+STATE_CODES = {state: code for code, state in enumerate(STATES)}
+
+# version, state code, timestamp, job id (-1: none), angle (NaN: none), pending jobs,
+# device id (utf-8, NUL padded and cut to 16 bytes; empty: none)
+_BINARY = struct.Struct('<BBdifH16s')
+BINARY_VERSION = 2
+
+TOPIC_PREFIX = 'status'
+STATS_TOPIC = 'stats'
+
+
+def encode_json(status, fields):
+    message = {"status": status}
+    message.update(fields)
+    return json.dumps(message).encode()
+
+
+def encode_msgpack(status, fields):
+    message = {"status": status}
+    message.update(fields)
+    return msgpack.packb(message)
+
+
+def encode_binary(status, fields):
+    # Fixed 36-byte record with the fields every status carries; extras such as
+    # "reason" or "merged" are only available in the json/msgpack encodings.
+    job = fields.get("job")
+    angle = fields.get("angle")
+    device = fields.get("device")
+    return _BINARY.pack(BINARY_VERSION, STATE_CODES.get(status, 255), fields.get("timestamp", 0.0),
+                        -1 if job is None else job, math.nan if angle is None else angle,
+                        fields.get("pending", 0), b'' if device is None else device.encode())
+
+
+def decode_binary(payload):
+    version, code, timestamp, job, angle, pending, device = _BINARY.unpack(payload)
+    message = {"status": STATES[code] if code < len(STATES) else "unknown", "timestamp": timestamp,
+               "pending": pending}
+    if job >= 0:
+        message["job"] = job
+    if not math.isnan(angle):
+        message["angle"] = angle
+    device = device.rstrip(b'\0')
+    if device:
+        message["device"] = device.decode()
+    return message
+
+
+ENCODERS = {
+    'json': encode_json,
+    'binary': encode_binary,
+    'msgpack': encode_msgpack,
+}
+
+
+class StatusPublisher:
+    """Publishes status changes on a PUB socket as they happen.
+
+    Each message is sent at once as two frames, topic and payload, with
+    topic "status.<state>[.<encoding>]", so subscribers can filter with a
+    prefix such as "status.completed". Metrics snapshots go out on the
+    "stats" topic. Between changes the current state
+    is repeated as a heartbeat every heartbeat seconds; nothing else is
+    sent while the state does not change. With topics=False the JSON
+    payload goes out as a single frame, the original wire format.
+    """
+
+    def __init__(self, socket, encoding='json', heartbeat=5.0, topics=True, lock=None):
+        if encoding == 'msgpack' and msgpack is None:
+            raise ValueError("msgpack encoding requested but msgpack is not installed")
+        if not topics and encoding != 'json':
+            raise ValueError("single-frame publishing only supports json")
+        self.socket = socket
+        self.encoding = encoding
+        self.heartbeat = heartbeat
+        self.topics = topics
+        self._encode = ENCODERS[encoding]
+        self._suffix = '' if encoding == 'json' else '.' + encoding
+        # Publishers sharing a socket must share its lock as well
+        self._lock = lock if lock is not None else threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._state = 'idle'
+        self._state_fields = {}
+        self._last_sent = time.monotonic()
+        self._closed = False
+        self._thread = None
+        self.sent = 0
+
+    @property
+    def state(self):
+        return self._state
+
+    def start(self):
+        if self._thread is None and self.heartbeat:
+            self._thread = threading.Thread(target=self._heartbeat_loop, name="status-heartbeat", daemon=True)
+            self._thread.start()
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            self._wakeup.notify()
+        if self._thread is not None:
+            self._thread.join()
+
+    def publish(self, status, state=None, **fields):
+        """Send one status message now.
+
+        state, when given, becomes the state repeated by heartbeats (e.g.
+        "processing" after "started"); by default the status itself.
+        """
+        fields.setdefault("timestamp", time.time())
+        payload = self._encode(status, fields)
+        with self._lock:
+            if self.topics:
+                topic = ('%s.%s%s' % (TOPIC_PREFIX, status, self._suffix)).encode()
+                self.socket.send_multipart((topic, payload))
+            else:
+                self.socket.send(payload)
+            self._last_sent = time.monotonic()
+            self.sent += 1
+            new_state = status if state is None else state
+            if new_state in STATE_CODES:
+                self._state = new_state
+                self._state_fields = {key: value for key, value in fields.items()
+                                      if key in ("device", "job", "angle", "pending")}
+
+    def publish_stats(self, stats):
+        """Send a metrics snapshot as json on topic "stats"; it does not change the state."""
+        payload = json.dumps(stats).encode()
+        with self._lock:
+            if self.topics:
+                self.socket.send_multipart((STATS_TOPIC.encode(), payload))
+            else:
+                self.socket.send(payload)
+
+    def _heartbeat_loop(self):
+        with self._lock:
+            while not self._closed:
+                due = self._last_sent + self.heartbeat - time.monotonic()
+                if due > 0:
+                    self._wakeup.wait(due)
+                    continue
+                state, fields = self._state, dict(self._state_fields)
+                self._wakeup.release()
+                try:
+                    self.publish(state, **fields)
+                finally:
+                    self._wakeup.acquire()
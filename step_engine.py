@@ -0,0 +1,373 @@
+import threading
+import time
+from array import array
+from bisect import bisect_right
+
+LOW = 0
+HIGH = 1
+
+DIR_SETUP_US = 10  # direction must be stable before the first step edge
+
+
+class Waveform:
+    """A move compiled into timed edges.
+
+    times_us[i] is the offset of edge i from the start of the move, and
+    pins[i] / levels[i] the pin and the level it is driven to. Edge 0 sets
+    the direction pin; after that every step is two edges on the pulse pin.
+    """
+
+    def __init__(self, pulse_pin, dir_pin, steps, first_level=LOW):
+        self.pulse_pin = pulse_pin
+        self.dir_pin = dir_pin
+        self.steps = steps
+        self.first_level = first_level
+        self.duration_us = 0
+        self.times_us = array('Q')
+        self.pins = array('B')
+        self.levels = array('B')
+
+    def __len__(self):
+        return len(self.times_us)
+
+    def add(self, time_us, pin, level):
+        self.times_us.append(time_us)
+        self.pins.append(pin)
+        self.levels.append(level)
+
+
+def compile_move(pulse_pin, dir_pin, direction, delays, steps=None, first_level=LOW):
+    """Compile a step train into a Waveform.
+
+    delays is either one half-period in seconds (constant speed, steps
+    required) or a sequence of per-step half-periods. Each step drives the
+    pulse pin to first_level, waits one half-period, drives it back and
+    waits again, the same pulse shape the bit-banged loops produce.
+    """
+    if isinstance(delays, (int, float)):
+        delays = [delays] * steps
+    elif hasattr(delays, 'tolist'):
+        # numpy profile arrays: iterating Python floats is much faster than numpy scalars
+        delays = delays.tolist()
+    steps = len(delays)
+    waveform = Waveform(pulse_pin, dir_pin, steps, first_level)
+    waveform.add(0, dir_pin, direction)
+    second_level = HIGH if first_level == LOW else LOW
+    t = DIR_SETUP_US
+    for delay in delays:
+        half_us = max(int(round(delay * 1e6)), 1)
+        waveform.add(t, pulse_pin, first_level)
+        t += half_us
+        waveform.add(t, pulse_pin, second_level)
+        t += half_us
+    # The last half-period belongs to the move, so back-to-back moves keep their spacing.
+    waveform.duration_us = t
+    return waveform
+
+
+class MoveHandle:
+    """Returned by StepBackend.submit(); the move runs in the background."""
+
+    def __init__(self, waveform):
+        self.waveform = waveform
+        self.edges_done = 0
+        self.started = None
+        self.finished = None
+        self._cancel = threading.Event()
+        self._done = threading.Event()
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def _steps(self, edges):
+        # A step is the rising edge of a pulse; it comes first in the pair when first_level is HIGH.
+        pulse_edges = max(edges - 1, 0)
+        if self.waveform.first_level == HIGH:
+            return (pulse_edges + 1) // 2
+        return pulse_edges // 2
+
+    @property
+    def steps_done(self):
+        return self._steps(self.edges_done)
+
+    def steps_at(self, timestamp):
+        """Steps completed by monotonic time timestamp, from the compiled schedule."""
+        if self.started is None:
+            return 0
+        return self._steps(bisect_right(self.waveform.times_us, (timestamp - self.started) * 1e6))
+
+    def _open_pulse(self):
+        # (pin, level) of the edge that completes a pulse a cancel cut in half, else None. Backends
+        # write it before finishing, so the pulse pin rests at its idle level and the step counted
+        # by _steps() is one the driver has seen.
+        if self.edges_done < 2 or self.edges_done % 2 or self.edges_done >= len(self.waveform):
+            return None
+        return self.waveform.pins[self.edges_done], self.waveform.levels[self.edges_done]
+
+    def cancel(self):
+        self._cancel.set()
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+    def _finish(self):
+        self.finished = time.monotonic()
+        self._done.set()
+
+
+class StepBackend:
+    """Executes waveforms. Moves are queued and run one after another."""
+
+    def submit(self, waveform):
+        raise NotImplementedError
+
+    def stop(self):
+        # Cancel the running and all queued moves.
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class ThreadedBackend(StepBackend):
+    """Plays waveforms from a worker thread against absolute deadlines.
+
+    The worker sleeps until shortly before each edge and only spins for the
+    last spin_us, so timing errors do not accumulate over a move and the
+    submitting thread is free as soon as submit() returns.
+    """
+
+    def __init__(self, write_pin, spin_us=80):
+        self._write_pin = write_pin
+        self._spin = spin_us / 1e6
+        self._queue = []
+        self._condition = threading.Condition()
+        self._current = None
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="step-engine", daemon=True)
+        self._thread.start()
+
+    def submit(self, waveform):
+        handle = MoveHandle(waveform)
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("Step backend is closed")
+            self._queue.append(handle)
+            self._condition.notify()
+        return handle
+
+    def stop(self):
+        with self._condition:
+            for handle in self._queue:
+                handle.cancel()
+                handle._finish()
+            self._queue.clear()
+            if self._current is not None:
+                self._current.cancel()
+
+    def close(self):
+        self.stop()
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._queue and not self._closed:
+                    self._condition.wait()
+                if self._closed and not self._queue:
+                    return
+                handle = self._current = self._queue.pop(0)
+            try:
+                self._play(handle)
+            finally:
+                with self._condition:
+                    self._current = None
+                handle._finish()
+
+    def _play(self, handle):
+        waveform = handle.waveform
+        write_pin = self._write_pin
+        spin = self._spin
+        times_us, pins, levels = waveform.times_us, waveform.pins, waveform.levels
+        start = time.monotonic()
+        handle.started = start
+        for i in range(len(times_us)):
+            if handle._cancel.is_set():
+                break
+            deadline = start + times_us[i] / 1e6
+            remaining = deadline - time.monotonic()
+            if remaining > spin:
+                time.sleep(remaining - spin)
+            while time.monotonic() < deadline:
+                pass
+            write_pin(pins[i], levels[i])
+            handle.edges_done = i + 1
+        edge = handle._open_pulse()
+        if edge is not None:
+            write_pin(*edge)
+            handle.edges_done += 1
+        if not handle._cancel.is_set():
+            remaining = start + waveform.duration_us / 1e6 - time.monotonic()
+            if remaining > 0:
+                time.sleep(remaining)
+
+
+class GPIOBackend(ThreadedBackend):
+    """ThreadedBackend driving pins through an RPi.GPIO compatible module."""
+
+    def __init__(self, gpio, spin_us=80):
+        super().__init__(gpio.output, spin_us)
+
+
+class SimulatedBackend(ThreadedBackend):
+    """Records every edge instead of driving hardware.
+
+    With realtime=True edges are played with the same timing loop as the
+    GPIO backend and recorded with their actual time, so throughput and
+    jitter of the executor can be measured anywhere. With realtime=False
+    moves complete immediately and edges are recorded at their ideal time.
+    """
+
+    def __init__(self, realtime=True, spin_us=80):
+        self.realtime = realtime
+        self.edges = []  # (monotonic time, pin, level)
+        self.levels = {}
+        self.late_us = []  # per edge: actual - scheduled
+        super().__init__(self._record, spin_us)
+
+    def _record(self, pin, level):
+        self.edges.append((time.monotonic(), pin, level))
+        self.levels[pin] = level
+
+    def _play(self, handle):
+        if self.realtime:
+            waveform = handle.waveform
+            first = len(self.edges)
+            super()._play(handle)
+            for i, (t, _, _) in enumerate(self.edges[first:first + handle.edges_done]):
+                self.late_us.append((t - handle.started) * 1e6 - waveform.times_us[i])
+            return
+        waveform = handle.waveform
+        handle.started = start = time.monotonic()
+        for i in range(len(waveform)):
+            if handle._cancel.is_set():
+                break
+            self.edges.append((start + waveform.times_us[i] / 1e6, waveform.pins[i], waveform.levels[i]))
+            self.levels[waveform.pins[i]] = waveform.levels[i]
+            handle.edges_done = i + 1
+        edge = handle._open_pulse()
+        if edge is not None:
+            self._record(*edge)
+            handle.edges_done += 1
+
+    def jitter(self):
+        """(mean, p99, max) lateness of recorded edges in microseconds."""
+        if not self.late_us:
+            return 0.0, 0.0, 0.0
+        late = sorted(self.late_us)
+        return sum(late) / len(late), late[int(0.99 * (len(late) - 1))], late[-1]
+
+
+class PigpioBackend(ThreadedBackend):
+    """Hardware-timed playback through the pigpio daemon's DMA waveforms.
+
+    Edges are converted to pigpio pulses and sent in chunks. Each chunk is
+    queued behind the one playing, and the worker waits until the hardware
+    is close to the end of it before building the next; a cancel wakes it
+    and stops the transmission at once.
+    """
+
+    CHUNK_PULSES = 4000
+
+    def __init__(self, pi=None):
+        import pigpio
+        self._pigpio = pigpio
+        self.pi = pi if pi is not None else pigpio.pi()
+        if not self.pi.connected:
+            raise RuntimeError("pigpio daemon is not running")
+        super().__init__(None)
+
+    def stop(self):
+        super().stop()
+        self.pi.wave_tx_stop()
+
+    def close(self):
+        super().close()
+        self.pi.wave_clear()
+        self.pi.stop()
+
+    def _pulses(self, waveform):
+        pigpio = self._pigpio
+        times_us, pins, levels = waveform.times_us, waveform.pins, waveform.levels
+        pulses = []
+        for i in range(len(times_us)):
+            end_us = times_us[i + 1] if i + 1 < len(times_us) else waveform.duration_us
+            mask = 1 << pins[i]
+            if levels[i]:
+                pulses.append(pigpio.pulse(mask, 0, end_us - times_us[i]))
+            else:
+                pulses.append(pigpio.pulse(0, mask, end_us - times_us[i]))
+        return pulses
+
+    def _play(self, handle):
+        pi = self.pi
+        cancel = handle._cancel
+        for pin in (handle.waveform.pulse_pin, handle.waveform.dir_pin):
+            pi.set_mode(pin, self._pigpio.OUTPUT)
+        pulses = self._pulses(handle.waveform)
+        handle.started = time.monotonic()
+        waves = []
+        for offset in range(0, len(pulses), self.CHUNK_PULSES):
+            if cancel.is_set():
+                break
+            chunk = pulses[offset:offset + self.CHUNK_PULSES]
+            pi.wave_add_generic(chunk)
+            wave_id = pi.wave_create()
+            pi.wave_send_using_mode(wave_id, self._pigpio.WAVE_MODE_ONE_SHOT_SYNC)
+            waves.append(wave_id)
+            if len(waves) > 1:
+                while pi.wave_tx_at() != wave_id and pi.wave_tx_busy() and not cancel.wait(0.002):
+                    pass
+                if cancel.is_set():
+                    break
+                pi.wave_delete(waves.pop(0))
+            handle.edges_done = offset
+            # Sleep through the chunk, but wake at once for a cancel (stop, sensor edge)
+            if cancel.wait(max(sum(pulse.delay for pulse in chunk) / 1e6 - 0.05, 0)):
+                break
+        while pi.wave_tx_busy() and not cancel.wait(0.005):
+            pass
+        if cancel.is_set():
+            pi.wave_tx_stop()
+            # DMA gives no edge count: take it from the schedule at the time we stopped.
+            stopped = time.monotonic()
+            handle.edges_done = min(bisect_right(handle.waveform.times_us, (stopped - handle.started) * 1e6),
+                                    len(pulses))
+            # The DMA stops wherever it is: put the pulse pin back to its idle level (the last edge's)
+            waveform = handle.waveform
+            if len(waveform) > 1:
+                pi.write(waveform.pulse_pin, waveform.levels[-1])
+            if handle._open_pulse() is not None:
+                handle.edges_done += 1
+        else:
+            handle.edges_done = len(pulses)
+        for wave_id in waves:
+            pi.wave_delete(wave_id)
+
+
+def default_backend(gpio):
+    """pigpio when its daemon is reachable, otherwise the threaded GPIO backend."""
+    if getattr(gpio, 'SIMULATED', False):
+        return GPIOBackend(gpio)
+    try:
+        return PigpioBackend()
+    except (ImportError, RuntimeError, OSError):
+        return GPIOBackend(gpio)